@@ -0,0 +1,77 @@
+"""store gene panels of families in a separate table
+
+Revision ID: a7d4e2b9c513
+Revises: f2b86d4e0a19
+Create Date: 2026-10-18 16:48:12.630917
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d4e2b9c513'
+down_revision = 'f2b86d4e0a19'
+branch_labels = None
+depends_on = None
+
+family_table = sa.table(
+    'family',
+    sa.column('id', sa.Integer),
+    sa.column('_panels', sa.Text),
+)
+
+
+def upgrade():
+    family_panel_table = op.create_table('family_panel',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('family_id', sa.Integer(), nullable=False),
+    sa.Column('panel', sa.String(length=64), nullable=False),
+    sa.ForeignKeyConstraint(['family_id'], ['family.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('family_id', 'panel', name='_family_panel_uc')
+    )
+    op.create_index(op.f('ix_family_panel_panel'), 'family_panel', ['panel'], unique=False)
+
+    # split the comma separated panels, keeping their order
+    connection = op.get_bind()
+    rows = connection.execute(sa.select([family_table.c.id, family_table.c['_panels']])
+                                .where(family_table.c['_panels'] != None)
+                                .order_by(family_table.c.id)).fetchall()
+    panel_rows = []
+    for family_id, panels_str in rows:
+        panels = []
+        for panel in panels_str.split(','):
+            panel = panel.strip()
+            if panel and panel not in panels:
+                panels.append(panel)
+        panel_rows.extend(dict(family_id=family_id, panel=panel) for panel in panels)
+    if panel_rows:
+        op.bulk_insert(family_panel_table, panel_rows)
+
+    op.drop_column('family', '_panels')
+
+
+def downgrade():
+    op.add_column('family', sa.Column('_panels', sa.Text(), nullable=True))
+
+    family_panel_table = sa.table(
+        'family_panel',
+        sa.column('id', sa.Integer),
+        sa.column('family_id', sa.Integer),
+        sa.column('panel', sa.String),
+    )
+    connection = op.get_bind()
+    rows = connection.execute(sa.select([family_panel_table.c.family_id,
+                                         family_panel_table.c.panel])
+                                .order_by(family_panel_table.c.id)).fetchall()
+    family_panels = {}
+    for family_id, panel in rows:
+        family_panels.setdefault(family_id, []).append(panel)
+    for family_id, panels in family_panels.items():
+        connection.execute(family_table.update()
+                                       .where(family_table.c.id == family_id)
+                                       .values({'_panels': ','.join(panels)}))
+
+    op.drop_index(op.f('ix_family_panel_panel'), table_name='family_panel')
+    op.drop_table('family_panel')
@@ -0,0 +1,99 @@
+"""add customer id to family for unique family names per customer
+
+Re-orders of existing families may reuse a name, only the names of new
+families are copied to the unique `unique_name` column.
+
+Revision ID: c3f0a7d15e62
+Revises: 8b1e4f6c2d90
+Create Date: 2026-10-18 14:05:52.904113
+
+"""
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3f0a7d15e62'
+down_revision = '8b1e4f6c2d90'
+branch_labels = None
+depends_on = None
+
+log = logging.getLogger('alembic.runtime.migration')
+
+family_table = sa.table(
+    'family',
+    sa.column('id', sa.Integer),
+    sa.column('name', sa.String),
+    sa.column('unique_name', sa.String),
+    sa.column('existing_family', sa.Boolean),
+    sa.column('customer_id', sa.Integer),
+    sa.column('project_id', sa.Integer),
+)
+project_table = sa.table(
+    'project',
+    sa.column('id', sa.Integer),
+    sa.column('is_locked', sa.Boolean),
+)
+
+
+def check_duplicates(connection):
+    """Stop if any customer has several new families with the same name.
+
+    The old check didn't prevent duplicates. They can't be renamed here
+    since submitted families are known in LIMS by their name, so they have
+    to be resolved by hand before upgrading.
+    """
+    rows = connection.execute(
+        sa.select([family_table.c.customer_id, family_table.c.name, family_table.c.id,
+                   family_table.c.project_id, project_table.c.is_locked])
+          .select_from(family_table.join(project_table,
+                                         family_table.c.project_id == project_table.c.id))
+          .where(family_table.c.unique_name != None)
+          .order_by(family_table.c.customer_id, family_table.c.name, family_table.c.id)
+    ).fetchall()
+    families = {}
+    for customer_id, name, family_id, project_id, is_locked in rows:
+        families.setdefault((customer_id, name), []).append(
+            "family {} in {} project {}".format(family_id,
+                                                'submitted' if is_locked else 'unsubmitted',
+                                                project_id))
+    conflicts = ["customer {}, '{}': {}".format(customer_id, name, '; '.join(duplicates))
+                 for (customer_id, name), duplicates in sorted(families.items()) if
+                 len(duplicates) > 1]
+    if conflicts:
+        for conflict in conflicts:
+            log.error("duplicate family name: %s", conflict)
+        raise ValueError("rename or remove {} duplicate family names before upgrading:\n{}"
+                         .format(len(conflicts), '\n'.join(conflicts)))
+
+
+def upgrade():
+    op.add_column('family', sa.Column('customer_id', sa.Integer(), nullable=True))
+    # copy the customer from the project of each family
+    op.execute("""
+        UPDATE family SET customer_id = (
+            SELECT project.customer_id FROM project WHERE project.id = family.project_id
+        )
+    """)
+    op.alter_column('family', 'customer_id',
+                    existing_type=mysql.INTEGER(display_width=11), nullable=False)
+    op.add_column('family', sa.Column('unique_name', sa.String(length=64), nullable=True))
+    connection = op.get_bind()
+    connection.execute(family_table.update()
+                                   .where(sa.or_(family_table.c.existing_family == None,
+                                                 family_table.c.existing_family == False))
+                                   .values(unique_name=family_table.c.name))
+    check_duplicates(connection)
+    op.create_foreign_key('family_customer_fk', 'family', 'customer', ['customer_id'], ['id'])
+    op.create_unique_constraint('_customer_family_name_uc', 'family',
+                                ['customer_id', 'unique_name'])
+
+
+def downgrade():
+    op.drop_constraint('family_customer_fk', 'family', type_='foreignkey')
+    op.drop_constraint('_customer_family_name_uc', 'family', type_='unique')
+    op.drop_column('family', 'unique_name')
+    op.drop_column('family', 'customer_id')
@@ -0,0 +1,60 @@
+"""store invoice data as compressed JSON instead of YAML
+
+Revision ID: e5a9c1d7f384
+Revises: c3f0a7d15e62
+Create Date: 2026-10-18 15:21:37.540218
+
+"""
+import io
+
+from alembic import op
+import ruamel.yaml
+import sqlalchemy as sa
+
+from cgadmin.store import serialize
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a9c1d7f384'
+down_revision = 'c3f0a7d15e62'
+branch_labels = None
+depends_on = None
+
+invoice_table = sa.table(
+    'invoice',
+    sa.column('id', sa.Integer),
+    sa.column('_data', sa.Text),
+    sa.column('packed_data', sa.LargeBinary),
+)
+
+
+def upgrade():
+    op.add_column('invoice', sa.Column('packed_data', sa.LargeBinary(length=2 ** 24 - 1),
+                                       nullable=True))
+    connection = op.get_bind()
+    yaml = ruamel.yaml.YAML(typ='safe')
+    rows = connection.execute(sa.select([invoice_table.c.id, invoice_table.c['_data']])
+                                .where(invoice_table.c['_data'] != None)).fetchall()
+    for invoice_id, yaml_str in rows:
+        invoice_data = yaml.load(yaml_str)
+        packed_data = serialize.pack(invoice_data) if invoice_data else None
+        connection.execute(invoice_table.update()
+                                        .where(invoice_table.c.id == invoice_id)
+                                        .values(packed_data=packed_data))
+    op.drop_column('invoice', '_data')
+
+
+def downgrade():
+    op.add_column('invoice', sa.Column('_data', sa.Text(), nullable=True))
+    connection = op.get_bind()
+    yaml = ruamel.yaml.YAML(typ='safe')
+    yaml.default_flow_style = False
+    rows = connection.execute(sa.select([invoice_table.c.id, invoice_table.c.packed_data])
+                                .where(invoice_table.c.packed_data != None)).fetchall()
+    for invoice_id, packed_data in rows:
+        yaml_stream = io.StringIO()
+        yaml.dump(serialize.unpack(packed_data), yaml_stream)
+        connection.execute(invoice_table.update()
+                                        .where(invoice_table.c.id == invoice_id)
+                                        .values(_data=yaml_stream.getvalue()))
+    op.drop_column('invoice', 'packed_data')
@@ -0,0 +1,91 @@
+"""move modified Excel invoices out of the database into the file store
+
+The files are written to the directory in CGADMIN_FILE_STORE_DIR, which
+should point to the same directory as the web app uses.
+
+Revision ID: f2b86d4e0a19
+Revises: e5a9c1d7f384
+Create Date: 2026-10-18 16:02:44.187305
+
+"""
+import os
+
+from alembic import op
+import sqlalchemy as sa
+
+from cgadmin.store.files import FileStore
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2b86d4e0a19'
+down_revision = 'e5a9c1d7f384'
+branch_labels = None
+depends_on = None
+
+COSTCENTERS = ('kth', 'ki')
+
+invoice_table = sa.table(
+    'invoice',
+    sa.column('id', sa.Integer),
+    sa.column('excel_file_kth', sa.LargeBinary),
+    sa.column('excel_file_ki', sa.LargeBinary),
+    sa.column('excel_kth_checksum', sa.String),
+    sa.column('excel_ki_checksum', sa.String),
+)
+
+
+def file_store():
+    root = os.environ.get('CGADMIN_FILE_STORE_DIR')
+    if not root:
+        raise ValueError("set CGADMIN_FILE_STORE_DIR to the file store of the app")
+    return FileStore(root)
+
+
+def upgrade():
+    for costcenter in COSTCENTERS:
+        op.add_column('invoice', sa.Column("excel_{}_checksum".format(costcenter),
+                                           sa.String(length=64), nullable=True))
+
+    connection = op.get_bind()
+    store = None
+    for costcenter in COSTCENTERS:
+        file_column = invoice_table.c["excel_file_{}".format(costcenter)]
+        # one row at a time to avoid loading all files into memory
+        invoice_ids = [row[0] for row in connection.execute(
+            sa.select([invoice_table.c.id]).where(file_column != None))]
+        for invoice_id in invoice_ids:
+            content = connection.execute(sa.select([file_column])
+                                           .where(invoice_table.c.id == invoice_id)).scalar()
+            store = store or file_store()
+            checksum = store.put_bytes(content)
+            connection.execute(invoice_table.update()
+                                            .where(invoice_table.c.id == invoice_id)
+                                            .values({"excel_{}_checksum".format(costcenter):
+                                                     checksum}))
+
+    for costcenter in COSTCENTERS:
+        op.drop_column('invoice', "excel_file_{}".format(costcenter))
+
+
+def downgrade():
+    for costcenter in COSTCENTERS:
+        op.add_column('invoice', sa.Column("excel_file_{}".format(costcenter), sa.BLOB(),
+                                           nullable=True))
+
+    connection = op.get_bind()
+    store = None
+    for costcenter in COSTCENTERS:
+        checksum_column = invoice_table.c["excel_{}_checksum".format(costcenter)]
+        rows = connection.execute(sa.select([invoice_table.c.id, checksum_column])
+                                    .where(checksum_column != None)).fetchall()
+        for invoice_id, checksum in rows:
+            store = store or file_store()
+            with store.open(checksum) as handle:
+                content = handle.read()
+            connection.execute(invoice_table.update()
+                                            .where(invoice_table.c.id == invoice_id)
+                                            .values({"excel_file_{}".format(costcenter):
+                                                     content}))
+
+    for costcenter in COSTCENTERS:
+        op.drop_column('invoice', "excel_{}_checksum".format(costcenter))
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
+import json
 import logging
 import os
+import time
 
 from cglims.api import ClinicalLims
 import click
@@ -9,10 +11,15 @@ import ruamel.yaml
 from cgadmin.report.core import report
 from cgadmin.store import models
 from cgadmin.store.api import AdminDatabase
-from cgadmin.store.parse import parse_db_project
+from cgadmin.store.parse import build_db_project, parse_db_project
 from cgadmin.log import init_log
-from cgadmin import lims
+from cgadmin.orderform import normalize_project, parse_orderforms
+from cgadmin import jobs, lims
+from cgadmin.fakelims import FakeLims, RecordingLims
+from cgadmin.journal import Journal
+from cgadmin.plan import plan_lims_project
 from cgadmin.invoice.cli import invoice
+from cgadmin.server.osticket import OsTicket
 
 log = logging.getLogger(__name__)
 
@@ -70,27 +77,107 @@ def projects(context, submitted):
 
 
 @root.command()
+@click.option('-w', '--workers', default=lims.WORKERS, show_default=True,
+              help='concurrent LIMS reads during pre-flight checks')
+@click.option('-p', '--plan', is_flag=True,
+              help='list the LIMS operations without writing anything')
+@click.option('-r', '--record', type=click.Path(file_okay=False),
+              help='save fetched LIMS entities as fixtures in this directory')
 @click.argument('project_id', type=int)
 @click.pass_context
-def upload(context, project_id):
+def upload(context, project_id, workers, plan, record):
     """Create a new LIMS project."""
-    new_project = context.obj['db'].Project.get(project_id)
-    if not new_project.is_locked:
+    new_project = context.obj['db'].project_graph(project_id)
+    if not new_project.is_locked and not plan:
         click.echo("project not yet submitted ({})".format(new_project.name))
         context.abort()
     elif new_project.lims_id:
         click.echo("project already added to LIMS: {}".format(new_project.lims_id))
         context.abort()
-    lims_api = ClinicalLims(context.obj['lims']['host'],
-                            context.obj['lims']['username'],
-                            context.obj['lims']['password'])
+    lims_config = context.obj['lims']
+    if record:
+        lims_api = RecordingLims(lims_config['host'], lims_config['username'],
+                                 lims_config['password'], fixtures=record)
+    else:
+        lims_api = ClinicalLims(lims_config['host'], lims_config['username'],
+                                lims_config['password'])
     project_data = parse_db_project(new_project)
-    lims_project = lims.new_lims_project(context.obj['db'], lims_api, project_data)
+    journal = Journal(context.obj['db'], new_project.id, dry_run=plan)
+    if plan:
+        lims_plan = plan_lims_project(context.obj['db'], lims_api, project_data,
+                                      workers=workers, journal=journal)
+        for operation, totals in lims_plan['summary'].items():
+            click.echo("{:<32} {:<5} {:>4} calls {:>6} items {:>10} bytes sent"
+                       .format(operation, totals['kind'], totals['calls'],
+                               totals['items'], totals['bytes_sent']))
+        click.echo("round trips: {round_trips} ({writes} writes), sent: {bytes_sent} "
+                   "bytes, received: {bytes_received} bytes".format(**lims_plan))
+        return
+    lims_project = lims.new_lims_project(context.obj['db'], lims_api, project_data,
+                                         workers=workers, journal=journal)
     new_project.lims_id = lims_project.id
     context.obj['db'].Project.save(new_project)
     click.echo("added new project to LIMS: {}".format(lims_project.id))
 
 
+@root.command()
+@click.option('-f', '--fixtures', type=click.Path(exists=True, file_okay=False),
+              help='LIMS entities recorded with "upload --record" to replay')
+@click.option('-l', '--latency', default=0.0, show_default=True,
+              help='seconds to delay each LIMS call')
+@click.option('--batch/--no-batch', default=True, show_default=True,
+              help='whether LIMS supports the batch resources')
+@click.option('-m', '--max-round-trips', type=int,
+              help='fail if the submission needs more LIMS calls')
+@click.option('-w', '--workers', default=lims.WORKERS, show_default=True,
+              help='concurrent LIMS reads during pre-flight checks')
+@click.argument('project_id', type=int)
+@click.pass_context
+def benchmark(context, project_id, fixtures, latency, batch, max_round_trips, workers):
+    """Submit a project to an in-process fake LIMS and count the calls."""
+    new_project = context.obj['db'].project_graph(project_id)
+    if new_project is None:
+        click.echo("project not found: {}".format(project_id))
+        context.abort()
+    project_data = parse_db_project(new_project)
+    lims_api = FakeLims(latency=latency, fixtures=fixtures, batch=batch)
+    # like a worker, which fetches the reference entities on start up
+    lims.REGISTRY.warm(lims_api)
+    lims_api.reset_calls()
+    start = time.time()
+    lims.new_lims_project(context.obj['db'], lims_api, project_data, workers=workers)
+    duration = time.time() - start
+    for call, count in sorted(lims_api.calls.items()):
+        click.echo("{:<32} {:>6} calls".format(call, count))
+    click.echo("round trips: {}, {:.2f} seconds".format(lims_api.round_trips, duration))
+    if max_round_trips is not None and lims_api.round_trips > max_round_trips:
+        click.echo("more than {} round trips".format(max_round_trips))
+        context.exit(1)
+
+
+@root.command()
+@click.option('-i', '--interval', default=5, show_default=True,
+              help='seconds to wait when the queue is empty')
+@click.option('-w', '--workers', default=lims.WORKERS, show_default=True,
+              help='concurrent LIMS reads during pre-flight checks')
+@click.option('-b', '--burst', is_flag=True, help='exit when the queue is empty')
+@click.pass_context
+def worker(context, interval, workers, burst):
+    """Process queued LIMS submissions."""
+    lims_api = ClinicalLims(context.obj['lims']['host'],
+                            context.obj['lims']['username'],
+                            context.obj['lims']['password'])
+    osticket_config = context.obj.get('osticket') or {
+        'api_key': os.environ['OSTICKET_API_KEY'],
+        'domain': os.environ['OSTICKET_DOMAIN'],
+    }
+    osticket = OsTicket()
+    osticket.setup(osticket_config['api_key'], osticket_config['domain'])
+    lims.REGISTRY.warm(lims_api)
+    jobs.work(context.obj['db'], lims_api, osticket, interval=interval,
+              workers=workers, burst=burst)
+
+
 @root.command()
 @click.option('-f', '--field', 'fields', multiple=True, help='fields to display')
 @click.argument('cust_id')
@@ -110,5 +197,57 @@ def customer(context, cust_id, fields):
         click.echo(raw_output)
 
 
+@root.group()
+def orderforms():
+    """Work with order form files."""
+    pass
+
+
+@orderforms.command('import')
+@click.option('-o', '--output', type=click.File('w'), default='-',
+              help='JSON Lines file to write parsed order forms to')
+@click.option('-p', '--processes', type=int, help='number of parsing processes')
+@click.option('-u', '--user', 'user_email', help='create draft projects owned by this user')
+@click.argument('directory', type=click.Path(exists=True, file_okay=False))
+@click.pass_context
+def import_orderforms(context, output, processes, user_email, directory):
+    """Parse all order forms in a directory."""
+    admin_db = context.obj['db']
+    user_obj = None
+    if user_email:
+        user_obj = admin_db.User.filter_by(email=user_email).first()
+        if user_obj is None:
+            click.echo("user not found: {}".format(user_email))
+            context.abort()
+
+    excel_paths = sorted(os.path.join(directory, filename) for filename in
+                         os.listdir(directory) if
+                         filename.lower().endswith(('.xls', '.xlsx')))
+    failed = 0
+    for excel_path, project_data, error in parse_orderforms(excel_paths, processes):
+        record = dict(path=excel_path, error=error)
+        if project_data:
+            record['project'] = normalize_project(project_data)
+            if user_obj:
+                name = os.path.splitext(os.path.basename(excel_path))[0]
+                try:
+                    new_project = build_db_project(admin_db, project_data, user_obj,
+                                                   name=name)
+                    admin_db.check_family_names(new_project.customer.id, [
+                        family_obj.name for family_obj in new_project.families if
+                        not family_obj.existing_family])
+                    admin_db.Project.save(new_project)
+                    record['project_id'] = new_project.id
+                except Exception as exc:
+                    admin_db.rollback()
+                    record['error'] = "unable to save project: {}: {}".format(
+                        exc.__class__.__name__, exc)
+        if record['error']:
+            failed += 1
+            log.warning("%s: %s", excel_path, record['error'])
+        output.write(json.dumps(record, sort_keys=True) + '\n')
+    log.info("parsed %s order forms, %s failed", len(excel_paths), failed)
+
+
 root.add_command(report)
 root.add_command(invoice)
@@ -27,6 +27,8 @@ PANELS = ['mtDNA', 'IBMFS', 'PIDCAD', 'SKD', 'OMIM-AUTO', 'ID', 'CTD', 'NJU', 'A
           'SPG', 'Ataxi', 'AD', 'MIT', 'ENDO', 'IEM', 'EP', 'HYP', 'DSD', 'SEXDIF',
           'SEXDET', 'NMD', 'PID', 'ET', 'PEDHEP']
 PRIORITIES = ['standard', 'priority', 'express', 'research']
+JOB_STATUSES = ['pending', 'running', 'completed', 'failed']
+JOURNAL_KINDS = ['project', 'container', 'sample']
 CUSTOMERS = [('cust003', 'CMMS'), ('cust002', 'Klinisk Genetik')]
 WELL_POSITIONS = ['A:1', 'B:1', 'C:1', 'D:1', 'E:1', 'F:1', 'G:1', 'H:1',
                   'A:2', 'B:2', 'C:2', 'D:2', 'E:2', 'F:2', 'G:2', 'H:2',
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+from collections import Counter
+import copy
+import itertools
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+from xml.etree import ElementTree
+
+from cglims.api import ClinicalLims
+from genologics.constants import nsmap
+import requests
+
+log = logging.getLogger(__name__)
+
+UDF_FIELD = nsmap('udf:field')
+RESOURCES = {
+    # resource: (XML prefix, entity tag, id prefix)
+    'samples': ('smp', 'sample', 'ACC'),
+    'containers': ('con', 'container', '27-'),
+    'projects': ('prj', 'project', 'PRJ'),
+    'researchers': ('res', 'researcher', ''),
+    'containertypes': ('ctp', 'container-type', ''),
+}
+
+
+class FakeLims(ClinicalLims):
+
+    """In-process stand-in for the parts of the LIMS API that cgadmin uses.
+
+    Entities are kept as XML in memory. Every call is counted per method and
+    resource and can be delayed by `latency` seconds to mimic a remote server.
+
+    Args:
+        latency (Optional[float]): seconds to sleep for each call
+        fixtures (Optional[path]): directory with recorded entity XML to replay
+        batch (Optional[bool]): whether to expose the batch resources
+    """
+
+    def __init__(self, latency=0, fixtures=None, batch=True,
+                 baseuri='http://fakelims.local'):
+        super(FakeLims, self).__init__(baseuri, 'fake', 'fake')
+        self.latency = latency
+        self.batch = batch
+        self.calls = Counter()
+        self.entities = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+        self.add('researchers', self._element('researchers', '3', {
+            'first-name': 'Clinical', 'last-name': 'Genomics'}))
+        for type_id, type_name in (('1', '96 well plate'), ('2', 'Tube')):
+            container_type = self._element('containertypes', type_id, {})
+            container_type.attrib['name'] = type_name
+            self.add('containertypes', container_type)
+        if fixtures:
+            self.load_fixtures(fixtures)
+
+    @property
+    def round_trips(self):
+        """Total number of calls made to the fake server."""
+        return sum(self.calls.values())
+
+    def reset_calls(self):
+        """Reset call counters, e.g. after setting up fixtures."""
+        with self._lock:
+            self.calls.clear()
+
+    def load_fixtures(self, directory):
+        """Replay entity XML recorded with `RecordingLims`."""
+        for filename in sorted(os.listdir(directory)):
+            if not filename.endswith('.xml'):
+                continue
+            with open(os.path.join(directory, filename), 'rb') as handle:
+                root = ElementTree.fromstring(handle.read())
+            resource, entity_id = split_uri(root.attrib['uri'])[:2]
+            root.attrib['uri'] = self.get_uri(resource, entity_id)
+            self.add(resource, root)
+
+    def add(self, resource, root):
+        """Store an entity, assigning a new id unless it already has one."""
+        with self._lock:
+            if 'uri' not in root.attrib:
+                entity_id = "{}{}".format(RESOURCES[resource][2], next(self._ids))
+                root.attrib['uri'] = self.get_uri(resource, entity_id)
+                root.attrib['limsid'] = entity_id
+            self.entities[root.attrib['uri']] = root
+        return root
+
+    def get(self, uri, params=dict()):
+        resource, entity_id, action = self._call('GET', uri)
+        if entity_id:
+            return copy.deepcopy(self._lookup(uri))
+        return self._query(resource, params or {})
+
+    def put(self, uri, data, params=dict()):
+        self._call('PUT', uri)
+        self._lookup(uri)
+        root = ElementTree.fromstring(data)
+        root.attrib['uri'] = uri
+        with self._lock:
+            self.entities[uri] = root
+        return copy.deepcopy(root)
+
+    def post(self, uri, data, params=dict()):
+        resource, entity_id, action = self._call('POST', uri)
+        root = ElementTree.fromstring(data)
+        if action is None:
+            return copy.deepcopy(self._create(resource, root))
+        if not self.batch:
+            raise not_found(uri)
+        if action == 'batch/create':
+            links = ElementTree.Element(nsmap('ri:links'))
+            for node in list(root):
+                created = self._create(resource, node)
+                ElementTree.SubElement(links, 'link', dict(
+                    uri=created.attrib['uri'], limsid=created.attrib['limsid'],
+                    rel=resource))
+            return links
+        elif action == 'batch/retrieve':
+            prefix = RESOURCES[resource][0]
+            details = ElementTree.Element(nsmap("{}:details".format(prefix)))
+            for link in root.findall('link'):
+                details.append(copy.deepcopy(self._lookup(link.attrib['uri'])))
+            return details
+        elif action == 'batch/update':
+            links = ElementTree.Element(nsmap('ri:links'))
+            for node in list(root):
+                self._lookup(node.attrib['uri'])
+                with self._lock:
+                    self.entities[node.attrib['uri']] = copy.deepcopy(node)
+                ElementTree.SubElement(links, 'link', dict(uri=node.attrib['uri'],
+                                                           rel=resource))
+            return links
+        raise not_found(uri)
+
+    def delete(self, uri, params=dict()):
+        self._call('DELETE', uri)
+        self._lookup(uri)
+        with self._lock:
+            del self.entities[uri]
+        return True
+
+    def _call(self, method, uri):
+        """Count and delay a call, return the parsed parts of the URI."""
+        resource, entity_id, action = split_uri(uri)
+        if entity_id:
+            key = "{} {}/<id>".format(method, resource)
+        elif action:
+            key = "{} {}/{}".format(method, resource, action)
+        else:
+            key = "{} {}".format(method, resource)
+        with self._lock:
+            self.calls[key] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return resource, entity_id, action
+
+    def _lookup(self, uri):
+        with self._lock:
+            root = self.entities.get(uri)
+        if root is None:
+            raise not_found(uri)
+        return root
+
+    def _query(self, resource, params):
+        """List entities matching name and UDF filters."""
+        prefix, tag = RESOURCES[resource][:2]
+        names = params.get('name')
+        if names is not None and not isinstance(names, (list, tuple)):
+            names = [names]
+        udf_filters = {key[4:]: str(value) for key, value in params.items()
+                       if key.startswith('udf.')}
+        listing = ElementTree.Element(nsmap("{}:{}".format(prefix, resource)))
+        with self._lock:
+            entities = [root for uri, root in self.entities.items() if
+                        split_uri(uri)[0] == resource]
+        for root in entities:
+            if names is not None and root.findtext('name') not in names:
+                continue
+            udfs = {field.attrib['name']: field.text for field in root.iter(UDF_FIELD)}
+            if any(udfs.get(key) != value for key, value in udf_filters.items()):
+                continue
+            node = ElementTree.SubElement(listing, tag, dict(uri=root.attrib['uri']))
+            if 'limsid' in root.attrib:
+                node.attrib['limsid'] = root.attrib['limsid']
+            if root.findtext('name') is not None:
+                ElementTree.SubElement(node, 'name').text = root.findtext('name')
+        return listing
+
+    def _create(self, resource, root):
+        """Store a new entity from its creation XML."""
+        if resource not in RESOURCES:
+            raise not_found(self.get_uri(resource))
+        prefix, tag = RESOURCES[resource][:2]
+        entity = ElementTree.Element(nsmap("{}:{}".format(prefix, tag)))
+        entity.extend(copy.deepcopy(list(root)))
+        entity.attrib.update({key: value for key, value in root.attrib.items()
+                              if key != 'uri'})
+        return self.add(resource, entity)
+
+    def _element(self, resource, entity_id, children):
+        prefix, tag = RESOURCES[resource][:2]
+        root = ElementTree.Element(nsmap("{}:{}".format(prefix, tag)), dict(
+            uri=self.get_uri(resource, entity_id), limsid=entity_id))
+        for child_tag, text in children.items():
+            ElementTree.SubElement(root, child_tag).text = text
+        return root
+
+
+class RecordingLims(ClinicalLims):
+
+    """LIMS API that saves every fetched entity as a replayable fixture.
+
+    Entities are recorded both when fetched one by one and when fetched
+    through the batch retrieve resources.
+    """
+
+    def __init__(self, baseuri, username, password, fixtures):
+        super(RecordingLims, self).__init__(baseuri, username, password)
+        self.fixtures = fixtures
+        if not os.path.isdir(fixtures):
+            os.makedirs(fixtures)
+
+    def get(self, uri, params=dict()):
+        root = super(RecordingLims, self).get(uri, params=params)
+        if split_uri(uri)[1]:
+            self.record(root)
+        return root
+
+    def post(self, uri, data, params=dict()):
+        root = super(RecordingLims, self).post(uri, data, params=params)
+        if split_uri(uri)[2] == 'batch/retrieve':
+            for entity in list(root):
+                self.record(entity)
+        return root
+
+    def record(self, root):
+        """Save the XML of an entity as a fixture."""
+        if 'uri' not in root.attrib:
+            return
+        resource, entity_id = split_uri(root.attrib['uri'])[:2]
+        filename = "{}_{}.xml".format(resource, entity_id)
+        with open(os.path.join(self.fixtures, filename), 'wb') as handle:
+            handle.write(self.tostring(ElementTree.ElementTree(root)))
+
+
+def split_uri(uri):
+    """Split a LIMS URI into resource, entity id and action."""
+    path = urlsplit(uri).path
+    segments = path.split('/api/', 1)[-1].split('/')[1:]
+    resource = segments[0] if segments else None
+    rest = segments[1:]
+    if rest and rest[0] == 'batch':
+        return resource, None, '/'.join(rest)
+    return resource, (rest[0] if rest else None), None
+
+
+def not_found(uri):
+    """Build the error the real API client raises for a missing resource."""
+    response = requests.Response()
+    response.status_code = 404
+    response.url = uri
+    return requests.exceptions.HTTPError("404: {} not found".format(uri),
+                                         response=response)
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timedelta
+import logging
+import threading
+import time
+
+from sqlalchemy import func
+
+from cgadmin.journal import Journal
+from cgadmin.lims import WORKERS, new_lims_project
+from cgadmin.store.models import Job
+
+HEARTBEAT_INTERVAL = 30
+STALE_AFTER = 5 * 60
+log = logging.getLogger(__name__)
+
+
+def enqueue(admin_db, project_data, user=None, project=None, open_ticket=True):
+    """Add a new submission job to the queue."""
+    job_obj = Job(user=user, project=project, open_ticket=open_ticket)
+    job_obj.data = project_data
+    return admin_db.Job.save(job_obj)
+
+
+def active_job(admin_db, project_id):
+    """Return the pending or running job for a project, if any."""
+    reap_stale(admin_db)
+    job_obj = (admin_db.Job.filter(Job.project_id == project_id,
+                                   Job.status.in_(['pending', 'running']))
+                           .first())
+    return job_obj
+
+
+def latest_job(admin_db, project_id):
+    """Return the most recent job for a project, if any."""
+    job_obj = (admin_db.Job.filter(Job.project_id == project_id)
+                           .order_by(Job.id.desc())
+                           .first())
+    return job_obj
+
+
+def orderform_jobs(admin_db, user_id=None, limit=10):
+    """Return the latest jobs for order forms, which aren't tied to a project."""
+    job_q = admin_db.Job.filter(Job.project_id == None)
+    if user_id is not None:
+        job_q = job_q.filter(Job.user_id == user_id)
+    return job_q.order_by(Job.id.desc()).limit(limit).all()
+
+
+def reap_stale(admin_db, stale_after=STALE_AFTER):
+    """Recover running jobs whose worker has stopped sending heartbeats.
+
+    Jobs for a project are queued again, the journal makes sure nothing is
+    created twice. Order form jobs have no journal so they are failed
+    instead, LIMS has to be checked before they are submitted again.
+    """
+    deadline = datetime.now() - timedelta(seconds=stale_after)
+    last_seen = func.coalesce(Job.heartbeat_at, Job.started_at)
+    stale_q = admin_db.Job.filter(Job.status == 'running', last_seen < deadline)
+    for job_obj in stale_q.all():
+        if job_obj.project_id:
+            values = {'status': 'pending', 'started_at': None, 'heartbeat_at': None}
+        else:
+            message = ("worker stopped responding during '{}', check LIMS before "
+                       "submitting again".format(job_obj.stage))
+            values = {'status': 'failed', 'finished_at': datetime.now(), 'message': message}
+        # only if no other process got to it first
+        updated = (admin_db.Job.filter(Job.id == job_obj.id, Job.status == 'running',
+                                       last_seen < deadline)
+                               .update(values, synchronize_session=False))
+        if updated == 1:
+            log.warning("job %s stopped responding, now %s", job_obj.id, values['status'])
+    admin_db.commit()
+
+
+def claim_next(admin_db):
+    """Claim the oldest pending job, safe to call from multiple workers."""
+    reap_stale(admin_db)
+    pending_q = admin_db.Job.filter_by(status='pending').order_by(Job.id).limit(10)
+    for job_id in [job_obj.id for job_obj in pending_q]:
+        updated = (admin_db.Job.filter_by(id=job_id, status='pending')
+                               .update({'status': 'running', 'started_at': datetime.now(),
+                                        'heartbeat_at': datetime.now()},
+                                       synchronize_session=False))
+        admin_db.commit()
+        if updated == 1:
+            job_obj = admin_db.Job.get(job_id)
+            admin_db.refresh(job_obj)
+            return job_obj
+    return None
+
+
+def run_job(admin_db, lims_api, osticket, job_obj, workers=WORKERS):
+    """Submit the project of a job to LIMS and open a ticket."""
+    def progress(stage, done, total):
+        stages = job_obj.progress
+        stages[stage] = {'done': done, 'total': total}
+        job_obj.progress = stages
+        job_obj.stage = stage
+        admin_db.Job.save(job_obj)
+
+    # resume from entities created by earlier attempts for the same project
+    journal = Journal(admin_db, job_obj.project_id) if job_obj.project_id else None
+    stop_heartbeat = threading.Event()
+    heartbeat = threading.Thread(target=send_heartbeats, args=(admin_db, job_obj.id,
+                                                               stop_heartbeat))
+    heartbeat.daemon = True
+    heartbeat.start()
+    try:
+        lims_project = new_lims_project(admin_db, lims_api, job_obj.data,
+                                        workers=workers, progress=progress,
+                                        journal=journal)
+        if lims_project:
+            job_obj.lims_id = lims_project.id
+            if (job_obj.open_ticket and job_obj.user and
+                    not lims_project.name.isdigit()):
+                progress('ticket', 0, 1)
+                ticket_id = osticket.open_ticket(
+                    name=job_obj.user.name,
+                    email=job_obj.user.email,
+                    subject=lims_project.name,
+                    message="New samples submitted",
+                )
+                lims_project.name = ticket_id
+                lims_project.put()
+                job_obj.ticket_id = ticket_id
+                progress('ticket', 1, 1)
+        if job_obj.project:
+            job_obj.project.is_locked = True
+            job_obj.project.lims_id = job_obj.lims_id
+        job_obj.status = 'completed'
+    except ValueError as error:
+        job_obj.status = 'failed'
+        job_obj.message = error.args[0]
+    except Exception as error:
+        log.exception("job %s crashed", job_obj.id)
+        admin_db.rollback()
+        job_obj.status = 'failed'
+        job_obj.message = "unexpected error: {}".format(error)
+    finally:
+        stop_heartbeat.set()
+        heartbeat.join()
+    job_obj.finished_at = datetime.now()
+    admin_db.Job.save(job_obj)
+    log.info("job %s %s: %s", job_obj.id, job_obj.status, job_obj.message or job_obj.lims_id)
+    return job_obj
+
+
+def send_heartbeats(admin_db, job_id, stop, interval=HEARTBEAT_INTERVAL):
+    """Mark a job as alive until `stop` is set."""
+    job_table = Job.__table__
+    while not stop.wait(interval):
+        # straight through the engine, the session belongs to the job thread
+        admin_db.engine.execute(job_table.update()
+                                         .where(job_table.c.id == job_id)
+                                         .values(heartbeat_at=datetime.now()))
+
+
+def work(admin_db, lims_api, osticket, interval=5, workers=WORKERS, burst=False):
+    """Process queued jobs until interrupted.
+
+    Args:
+        interval (int): seconds to wait when the queue is empty
+        burst (bool): stop when the queue is empty
+    """
+    while True:
+        job_obj = claim_next(admin_db)
+        if job_obj:
+            log.info("processing job %s", job_obj.id)
+            run_job(admin_db, lims_api, osticket, job_obj, workers=workers)
+        elif burst:
+            break
+        else:
+            time.sleep(interval)
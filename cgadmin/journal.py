@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from cgadmin.store.models import JournalEntry
+
+log = logging.getLogger(__name__)
+
+
+class Journal(object):
+
+    """Record of LIMS entities created while submitting a project.
+
+    Entries are committed as soon as an entity (or a batch of them) has been
+    created so a failed submission can be retried without creating anything
+    twice. With `dry_run` new entries are only kept in memory.
+    """
+
+    def __init__(self, admin_db, project_id, dry_run=False):
+        self.admin_db = admin_db
+        self.project_id = project_id
+        self.dry_run = dry_run
+        self._uris = {(entry.kind, entry.name): entry.lims_uri for entry in
+                      admin_db.JournalEntry.filter_by(project_id=project_id)}
+        if self._uris:
+            log.info("resuming project %s with %s journaled LIMS entities",
+                     project_id, len(self._uris))
+
+    def get(self, kind, name):
+        """Get the URI of a previously created entity, if any."""
+        return self._uris.get((kind, name))
+
+    def record(self, kind, entities):
+        """Record newly created entities.
+
+        Args:
+            kind (str): 'project', 'container' or 'sample'
+            entities (dict): name -> LIMS entity
+        """
+        new_entries = []
+        for name, entity in entities.items():
+            self._uris[(kind, name)] = entity.uri
+            if self.dry_run:
+                continue
+            new_entries.append(JournalEntry(project_id=self.project_id, kind=kind,
+                                            name=name, lims_uri=entity.uri))
+        if new_entries:
+            self.admin_db.add_all(new_entries)
+            self.admin_db.commit()
@@ -1,33 +1,188 @@
 # -*- coding: utf-8 -*-
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import threading
+import time
 from xml.etree import ElementTree
 
 from cglims.apptag import ApplicationTag
-from flask import flash
+from flask import flash, has_request_context
+from genologics.constants import nsmap
 from genologics.entities import (Project, Researcher, Sample, Container,
                                  Containertype)
-from jsonschema import validate
-from cgadmin.schema import schema_project
+from requests.exceptions import HTTPError, RequestException
+from cgadmin.schema import VALIDATORS
+from cgadmin.store import models
 
 SEX_MAP = {'male': 'M', 'female': 'F', 'unknown': 'unknown'}
 GENDER_MAP = {value: key for key, value in SEX_MAP.items()}
 CON_TYPES = {'Tube': 2, '96 well plate': 1}
+RESEARCHER_ID = '3'
+BATCH_SIZE = 100
+# concurrent LIMS reads per submission
+WORKERS = 4
 log = logging.getLogger(__name__)
 
 
-def new_lims_project(admin_db, lims_api, project_data):
-    """Create a new project with samples in LIMS."""
-    validate(project_data, schema_project)
-    prepare_data(admin_db, project_data)
+class BatchUnavailableError(Exception):
+    pass
+
+
+class SubmissionError(ValueError):
+
+    """All problems found with a project submission.
+
+    Args:
+        errors (List[tuple]): pairs of path (list of names) and message
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        lines = [' -> '.join([str(step) for step in path if step is not None] + [message])
+                 for path, message in errors]
+        super(SubmissionError, self).__init__("\n".join(lines))
+
+
+class LimsRegistry(object):
+
+    """Process-wide cache of rarely changing LIMS reference entities.
+
+    Researchers and container types are fetched once and refreshed after
+    `refresh_interval` seconds.
+    """
+
+    def __init__(self, refresh_interval=6 * 3600):
+        self.refresh_interval = refresh_interval
+        self._entities = {}
+        self._lock = threading.Lock()
+
+    def researcher(self, lims_api, researcher_id=RESEARCHER_ID):
+        """Get a researcher entity."""
+        return self._get(lims_api, Researcher, str(researcher_id))
+
+    def container_type(self, lims_api, type_id):
+        """Get a container type entity."""
+        return self._get(lims_api, Containertype, str(type_id))
+
+    def warm(self, lims_api):
+        """Fetch the reference entities we use up front."""
+        try:
+            self.researcher(lims_api)
+            for type_id in CON_TYPES.values():
+                self.container_type(lims_api, type_id)
+        except RequestException as error:
+            log.warning("unable to warm LIMS registry: %s", error)
+
+    def entities(self, lims_api):
+        """Get the cached entities that were fetched through a LIMS API."""
+        with self._lock:
+            return [entity for _, entity in self._entities.values() if
+                    entity.lims is lims_api]
+
+    def clear(self):
+        """Forget all cached entities."""
+        with self._lock:
+            self._entities.clear()
+
+    def _get(self, lims_api, klass, entity_id):
+        key = (lims_api.baseuri, klass.__name__, entity_id)
+        now = time.time()
+        with self._lock:
+            cached = self._entities.get(key)
+        if cached and cached[1].lims is not lims_api:
+            cached = None
+        if cached and now - cached[0] < self.refresh_interval:
+            return cached[1]
+        entity = klass(lims_api, id=entity_id)
+        entity.get(force=cached is not None)
+        with self._lock:
+            self._entities[key] = (now, entity)
+        return entity
+
+
+REGISTRY = LimsRegistry()
+
+
+class LimsIndex(object):
+
+    """In-memory index of the sample names and family ids of a customer.
+
+    Loaded once per submission so the pre-flight checks don't have to query
+    LIMS for every sample and family. Only the names and family ids in the
+    submission are looked up.
+    """
+
+    def __init__(self, lims_api, customer):
+        self.lims_api = lims_api
+        self.customer = customer
+        self.samples = {}
+        self.families = set()
+
+    def load(self, sample_names, family_ids, workers=1):
+        """Look up the given sample names and family ids of the customer."""
+        sample_names = sorted(set(sample_names))
+        for start in range(0, len(sample_names), BATCH_SIZE):
+            lims_samples = self.lims_api.get_samples(
+                name=sample_names[start:start + BATCH_SIZE], udf={'customer': self.customer})
+            # the listing has no names, fetch the matches in one go
+            batch_retrieve(self.lims_api, lims_samples)
+            for lims_sample in lims_samples:
+                self.samples.setdefault(lims_sample.name, []).append(lims_sample)
+
+        # the sample listing is enough to tell whether a family exists
+        family_ids = sorted(set(family_ids))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            listings = executor.map(self.family_samples, family_ids)
+            for family_id, lims_samples in zip(family_ids, listings):
+                if lims_samples:
+                    self.families.add(family_id)
+        log.debug("found %s of %s samples, %s of %s families for %s", len(self.samples),
+                  len(sample_names), len(self.families), len(family_ids), self.customer)
+        return self
+
+    def family_samples(self, family_id):
+        """List the samples of a family."""
+        return self.lims_api.get_samples(udf={'customer': self.customer,
+                                              'familyID': family_id})
+
+    def has_sample(self, sample_name):
+        """Check if a sample name is already used."""
+        return sample_name in self.samples
+
+    def has_family(self, family_id):
+        """Check if a family id is already used."""
+        return family_id in self.families
+
+
+def new_lims_project(admin_db, lims_api, project_data, workers=WORKERS, progress=None,
+                     journal=None):
+    """Create a new project with samples in LIMS.
+
+    Args:
+        workers (Optional[int]): max number of concurrent pre-flight LIMS reads
+        progress (Optional[callable]): called with (stage, done, total)
+        journal (Optional[Journal]): created entities are recorded here and
+            entities recorded by an earlier attempt are reused
+    """
+    progress = progress or ignore_progress
+    progress('validate', 0, 1)
+    validate_project(admin_db, project_data)
+    progress('validate', 1, 1)
+
+    progress('checks', 0, 1)
+    sample_names = [sample_data['name'] for family_data in project_data['families'] for
+                    sample_data in family_data['samples']]
+    family_ids = [family_data['name'] for family_data in project_data['families']]
+    lims_index = LimsIndex(lims_api, project_data['customer']).load(sample_names, family_ids,
+                                                                    workers=workers)
+    run_checks(lims_index, project_data)
+    progress('checks', 1, 1)
 
     # separate existing from new samples
     new_samples = []
     existing_samples = []
     for family_data in project_data['families']:
-        check_family(lims_api, family_data)
         for sample_data in family_data['samples']:
-            log.debug("checking sample: %s", sample_data['name'])
-            check_sample(lims_api, sample_data)
             if sample_data.get('existing_sample'):
                 existing_samples.append(sample_data)
             else:
@@ -35,141 +190,387 @@ def new_lims_project(admin_db, lims_api, project_data):
 
     if existing_samples:
         # update information about existing samples
-        for sample_data in existing_samples:
-            log.info("updating existing sample: {}".format(sample_data['name']))
-            update_existing_sample(lims_api, sample_data)
+        progress('existing', 0, len(existing_samples))
+        update_existing_samples(lims_api, existing_samples)
+        progress('existing', len(existing_samples), len(existing_samples))
 
     if new_samples:
-        lims_project = make_project(lims_api, project_data, researcher_id='3')
-        log.info("added new LIMS project: %s", lims_project.id)
+        progress('project', 0, 1)
+        project_uri = journal.get('project', project_data['name']) if journal else None
+        if project_uri:
+            lims_project = Project(lims_api, uri=project_uri)
+            log.info("resuming LIMS project: %s", lims_project.id)
+        else:
+            lims_project = make_project(lims_api, project_data)
+            log.info("added new LIMS project: %s", lims_project.id)
+            if journal:
+                journal.record('project', {project_data['name']: lims_project})
+        progress('project', 1, 1)
+
         container_groups = group_containers(project_data)
-        for container_name, samples in container_groups.items():
-            lims_container = make_container(lims_api, container_name)
-            for sample_data in samples:
-                lims_sample = make_sample(lims_api, sample_data, lims_project, lims_container)
-                log.info("added new LIMS sample: %s", lims_sample.id)
+        lims_containers = resume_entities(lims_api, journal, 'container', Container,
+                                          container_groups)
+        progress('containers', len(lims_containers), len(container_groups))
+        missing_containers = [container_name for container_name in container_groups
+                              if container_name not in lims_containers]
+        if missing_containers:
+            def containers_created(created):
+                if journal:
+                    journal.record('container', created)
+                lims_containers.update(created)
+                progress('containers', len(lims_containers), len(container_groups))
+
+            make_containers(lims_api, missing_containers, on_batch=containers_created)
+
+        placements = [(sample_data, lims_containers[container_name]) for
+                      container_name, samples in container_groups.items() for
+                      sample_data in samples]
+        sample_keys = [journal_key(sample_data) for sample_data, _ in placements]
+        lims_samples = resume_entities(lims_api, journal, 'sample', Sample, sample_keys)
+        progress('samples', len(lims_samples), len(placements))
+        missing_placements = [placement for placement, sample_key in
+                              zip(placements, sample_keys) if sample_key not in lims_samples]
+        if missing_placements:
+            def samples_created(created):
+                created = {journal_key(sample_data): lims_sample for
+                           sample_data, lims_sample in created}
+                if journal:
+                    journal.record('sample', created)
+                lims_samples.update(created)
+                for lims_sample in created.values():
+                    log.info("added new LIMS sample: %s", lims_sample.id)
+                progress('samples', len(lims_samples), len(placements))
+
+            make_samples(lims_api, missing_placements, lims_project,
+                         on_batch=samples_created)
 
         return lims_project
 
 
-def update_existing_sample(lims_api, sample_data):
-    """Update information about an existing sample."""
-    lims_samples = lims_api.get_samples(name=sample_data['name'],
-                                        udf={'customer': sample_data['customer']})
-    lims_sample = lims_samples[0]
+def resume_entities(lims_api, journal, kind, klass, names):
+    """Look up entities created by an earlier attempt in the journal.
+
+    Returns:
+        dict: name -> LIMS entity for the journaled names
+    """
+    entities = {}
+    if journal:
+        for name in names:
+            entity_uri = journal.get(kind, name)
+            if entity_uri:
+                entities[name] = klass(lims_api, uri=entity_uri)
+        if entities:
+            log.info("reusing %s journaled %ss", len(entities), kind)
+    return entities
+
+
+def journal_key(sample_data):
+    """Identify a sample in the journal, names are unique per family."""
+    return "{}/{}".format(sample_data['family']['name'], sample_data['name'])
+
+
+def ignore_progress(stage, done, total):
+    """Default progress callback, does nothing."""
+    pass
+
+
+def update_existing_samples(lims_api, samples):
+    """Update information about existing samples.
+
+    Samples are fetched and saved in batches and only samples with changed
+    UDFs are written back. Cached XML is always refreshed first so the
+    changes are based on the current LIMS state.
+    """
+    customer = samples[0]['customer']
+    names = [sample_data['name'] for sample_data in samples]
+    lims_samples = []
+    for start in range(0, len(names), BATCH_SIZE):
+        lims_samples.extend(lims_api.get_samples(name=names[start:start + BATCH_SIZE],
+                                                 udf={'customer': customer}))
+    for start in range(0, len(lims_samples), BATCH_SIZE):
+        batch_retrieve(lims_api, lims_samples[start:start + BATCH_SIZE], force=True)
+    sample_map = {}
+    for lims_sample in lims_samples:
+        sample_map.setdefault(lims_sample.name, lims_sample)
+
+    changed_samples = []
+    for sample_data in samples:
+        lims_sample = sample_map.get(sample_data['name'])
+        if lims_sample is None:
+            raise ValueError("can't find existing sample: {}".format(sample_data['name']))
+        if update_existing_sample(lims_sample, sample_data):
+            changed_samples.append(lims_sample)
+
+    for start in range(0, len(changed_samples), BATCH_SIZE):
+        batch_update(lims_api, changed_samples[start:start + BATCH_SIZE])
+    log.info("updated %s existing samples, skipped %s without changes",
+             len(changed_samples), len(samples) - len(changed_samples))
+
+
+def update_existing_sample(lims_sample, sample_data):
+    """Update UDFs of an existing sample.
+
+    Returns:
+        bool: whether any UDF value changed
+    """
+    new_udfs = {}
     if sample_data.get('sex'):
-        old_value = lims_sample.udf.get('Gender')
-        new_value = SEX_MAP.get(sample_data['sex'])
-        log.info("updating 'Gender': %s -> %s", old_value, new_value)
-        lims_sample.udf['Gender'] = new_value
-
+        new_udfs['Gender'] = SEX_MAP.get(sample_data['sex'])
     if sample_data.get('status'):
-        udf_key = 'Status'
-        old_value = lims_sample.udf.get(udf_key)
-        new_value = sample_data['status']
-        log.info("updating %s: %s -> %s", udf_key, old_value, new_value)
-        lims_sample.udf[udf_key] = new_value
-
+        new_udfs['Status'] = sample_data['status']
     for parent_id in ['mother', 'father']:
-        new_value = sample_data.get(parent_id)
-        if new_value:
-            udf_key = "{}ID".format(parent_id)
-            old_value = lims_sample.udf.get(udf_key)
-            log.info("updating '%s': %s -> %s", udf_key, old_value, new_value)
-            lims_sample.udf[udf_key] = new_value
-
+        if sample_data.get(parent_id):
+            new_udfs["{}ID".format(parent_id)] = sample_data[parent_id]
     if sample_data.get('capture_kit'):
-        udf_key = 'Capture Library version'
-        old_value = lims_sample.udf.get(udf_key)
-        new_value = sample_data['capture_kit']
-        log.info("updating '%s': %s -> %s", udf_key, old_value, new_value)
-        lims_sample.udf[udf_key] = new_value
-
+        new_udfs['Capture Library version'] = sample_data['capture_kit']
     if sample_data['family'].get('panels'):
-        udf_key = 'Gene List'
+        new_udfs['Gene List'] = ';'.join(sample_data['family']['panels'])
+
+    is_changed = False
+    for udf_key, new_value in new_udfs.items():
         old_value = lims_sample.udf.get(udf_key)
-        new_value = ';'.join(sample_data['family']['panels'])
-        log.info("updating '%s': %s -> %s", udf_key, old_value, new_value)
-        lims_sample.udf[udf_key] = new_value
+        if old_value != new_value:
+            log.info("updating '%s' for %s: %s -> %s", udf_key, lims_sample.id,
+                     old_value, new_value)
+            lims_sample.udf[udf_key] = new_value
+            is_changed = True
+    return is_changed
+
+
+def batch_retrieve(lims_api, instances, force=False):
+    """Fetch entities through the LIMS batch resource, one by one as fallback."""
+    try:
+        lims_api.get_batch(instances, force=force)
+    except HTTPError as error:
+        if not is_unavailable(error):
+            raise
+        log.warning("batch retrieve not available, fetching one by one")
+        for instance in instances:
+            instance.get(force=force)
+
+
+def batch_update(lims_api, instances):
+    """Save entities through the LIMS batch resource, one by one as fallback."""
+    try:
+        lims_api.put_batch(instances)
+    except HTTPError as error:
+        if not is_unavailable(error):
+            raise
+        log.warning("batch update not available, saving one by one")
+        for instance in instances:
+            instance.put()
+
+
+def is_unavailable(error):
+    """Check if a LIMS error means the resource doesn't exist."""
+    return error.response is not None and error.response.status_code in (404, 405)
+
+
+def run_checks(lims_index, project_data):
+    """Run the family and sample checks against the LIMS index.
+
+    Warnings are reported and all errors are raised together in the order
+    the families and samples appear in the order form.
+    """
+    errors = []
+    for family_data in project_data['families']:
+        checks = [(check_family, family_data)]
+        checks.extend((check_sample, sample_data) for sample_data in family_data['samples'])
+        for check_func, data in checks:
+            warnings, check_errors = check_func(lims_index, data)
+            for message in warnings:
+                warn(message)
+            errors.extend(check_errors)
+    if errors:
+        raise SubmissionError(errors)
+
+
+def warn(message):
+    """Flash a warning to the user, log it outside of a request."""
+    if has_request_context():
+        flash(message, 'warning')
+    else:
+        log.warning(message)
 
-    log.info("saving sample data for: %s", lims_sample.id)
-    lims_sample.put()
 
+def check_sample(lims_index, sample_data):
+    """Check sample data against what already exists in LIMS.
 
-def check_sample(lims_api, sample_data):
-    """Check sample data before inserting into LIMS."""
-    lims_samples = lims_api.get_samples(name=sample_data['name'],
-                                        udf={'customer': sample_data['customer']})
+    Returns:
+        tuple: warning messages, (path, message) errors
+    """
+    log.debug("checking sample: %s", sample_data['name'])
+    warnings = []
+    errors = []
     # TODO: could add check if other samples are canceled...
     existing_sample = sample_data.get('existing_sample')
-    if existing_sample and len(lims_samples) == 0:
-        raise ValueError("can't find existing sample: {}".format(sample_data['name']))
-    elif not existing_sample and len(lims_samples) > 0:
-        flash("duplicate sample name: {}".format(sample_data['name']), 'warning')
-
-    family_id = sample_data['family']['name']
-    lims_samples = lims_api.get_samples(udf={'customer': sample_data['customer'],
-                                             'familyID': family_id})
-    if sample_data['family'].get('existing_family') and len(lims_samples) == 0:
-        raise ValueError("can't find existing family: {}".format(family_id))
-    elif not sample_data['family'].get('existing_family') and len(lims_samples) > 0:
-        flash("duplicate family name: {}".format(family_id), 'warning')
+    is_known = lims_index.has_sample(sample_data['name'])
+    if existing_sample and not is_known:
+        errors.append(([sample_data['family']['name'], sample_data['name']],
+                       "can't find existing sample"))
+    elif not existing_sample and is_known:
+        warnings.append("duplicate sample name: {}".format(sample_data['name']))
+    return warnings, errors
+
+
+def check_family(lims_index, family_data):
+    """Check family data against what already exists in LIMS.
+
+    Returns:
+        tuple: warning messages, (path, message) errors
+    """
+    warnings = []
+    errors = []
+    family_id = family_data['name']
+    is_known = lims_index.has_family(family_id)
+    if family_data.get('existing_family') and not is_known:
+        errors.append(([family_id], "can't find existing family"))
+    elif not family_data.get('existing_family') and is_known:
+        warnings.append("duplicate family name: {}".format(family_id))
+    return warnings, errors
+
+
+def validate_project(admin_db, project_data):
+    """Validate a project in a single pass before anything is sent to LIMS.
+
+    Schema, application tag, relationship, container and Scout errors are
+    collected with their paths and raised together. Sample data is prepared
+    for the LIMS steps on the way.
+    """
+    errors = []
+    for error in VALIDATORS.validator(admin_db).iter_errors(project_data):
+        path = error_path(project_data, error.absolute_path)
+        errors.append((path, error.message))
+
+    families = project_data.get('families') if isinstance(project_data, dict) else None
+    if isinstance(families, list):
+        apptags = load_apptags(admin_db, project_data)
+        for family_data in families:
+            if not isinstance(family_data, dict):
+                continue
+            samples = family_data.get('samples')
+            for sample_data in (samples if isinstance(samples, list) else []):
+                if isinstance(sample_data, dict):
+                    errors.extend(prepare_sample(apptags, project_data, family_data,
+                                                 sample_data))
+            errors.extend(check_family_data(family_data))
+
+    if errors:
+        raise SubmissionError(errors)
 
+
+def load_apptags(admin_db, project_data):
+    """Fetch all application tags used in a project with one query."""
+    names = set()
+    for family_data in project_data['families']:
+        for sample_data in family_data.get('samples') or []:
+            apptag_name = sample_data.get('application_tag') if isinstance(sample_data,
+                                                                           dict) else None
+            if apptag_name and isinstance(apptag_name, str):
+                names.add(apptag_name)
+    if not names:
+        return {}
+    apptag_query = admin_db.ApplicationTag.filter(models.ApplicationTag.name.in_(names))
+    return {apptag_obj.name: apptag_obj for apptag_obj in apptag_query}
+
+
+def prepare_sample(apptags, project_data, family_data, sample_data):
+    """Prepare sample data for LIMS and check it.
+
+    Returns:
+        list: (path, message) errors
+    """
+    path = [family_data.get('name'), sample_data.get('name')]
+    errors = []
+    sample_data['family'] = family_data
+    sample_data['customer'] = project_data.get('customer')
+    if 'application_tag' in sample_data:
+        apptag_name = sample_data['application_tag']
+        apptag_obj = apptags.get(apptag_name) if isinstance(apptag_name, str) else None
+        if apptag_obj is None:
+            # already reported by the schema
+            return errors
+        elif not apptag_obj.versions:
+            errors.append((path, "no versions of application tag: {}".format(apptag_name)))
+            return errors
+        sample_data['apptag'] = ApplicationTag(apptag_name)
+        sample_data['is_external'] = sample_data['apptag'].is_external
+        sample_data['application_tag_version'] = apptag_obj.versions[0].version
+
+    existing_sample = sample_data.get('existing_sample')
     if existing_sample:
         pass
+    elif 'apptag' not in sample_data:
+        errors.append((path, "new sample needs 'application tag'"))
     elif sample_data['is_external']:
         if sample_data['apptag'].is_panel and sample_data.get('capture_kit') is None:
-            raise ValueError("external exome samples needs 'capture kit'!")
+            errors.append((path, "external exome samples needs 'capture kit'!"))
     else:
         if sample_data.get('container') is None:
-            raise ValueError("non-external sample missing 'container': {}"
-                             .format(sample_data['name']))
+            errors.append((path, "non-external sample missing 'container'"))
+        elif not isinstance(sample_data['container'], str):
+            # already reported by the schema
+            pass
+        elif sample_data['container'] not in CON_TYPES:
+            errors.append((path, "unsupported container: {}".format(sample_data['container'])))
+        elif (sample_data['container'] == '96 well plate' and
+                not sample_data.get('container_name')):
+            errors.append((path, "plate sample missing 'container name'"))
         if sample_data.get('source') is None:
-            raise ValueError("non-external sample missing 'source': {}"
-                             .format(sample_data['name']))
+            errors.append((path, "non-external sample missing 'source'"))
 
-    if not existing_sample and sample_data['family']['delivery_type'] == 'scout':
-        log.debug("sample intended for Scout upload, checking required fields")
+    if not existing_sample and family_data.get('delivery_type') == 'scout':
         if sample_data.get('status') is None:
-            raise ValueError("sample needs 'status' for upload to Scout: {}"
-                             .format(sample_data['name']))
-
-
-def check_family(lims_api, family_data):
-    """Check family data, mostly relationships."""
-    if len(family_data['samples']) > 1:
-        relations = [sample_data for sample_data in family_data['samples']
-                     if (sample_data.get('mother') or sample_data.get('father'))]
-        sample_map = {sample_data['name'] for sample_data in family_data['samples']}
-        for sample_data in relations:
-            for parent_key in ('mother', 'father'):
-                if parent_key in sample_data:
-                    parent_id = sample_data[parent_key]
-                    if parent_id and parent_id not in sample_map:
-                        sample_name = sample_data['name']
-                        raise ValueError("sample relation error: {}, {} -> {}"
-                                         .format(sample_name, parent_key, parent_id))
-
-    if family_data['delivery_type'] == 'scout':
-        if 'panels' not in family_data:
-            raise ValueError("family needs 'gene panel' for upload to Scout: {}"
-                             .format(family_data['name']))
-
-
-def prepare_data(admin_db, project_data):
-    """Prepare the data before processing it."""
-    for family_data in project_data['families']:
-        for sample_data in family_data['samples']:
-            if 'application_tag' in sample_data:
-                apptag_name = sample_data['application_tag']
-                apptag_obj = admin_db.ApplicationTag.filter_by(name=apptag_name).first()
-                if apptag_obj is None:
-                    raise ValueError("unknown application tag: {}".format(apptag_name))
-                sample_data['apptag'] = ApplicationTag(apptag_name)
-                sample_data['is_external'] = sample_data['apptag'].is_external
-                sample_data['application_tag_version'] = apptag_obj.versions[0].version
-            sample_data['family'] = family_data
-            sample_data['customer'] = project_data['customer']
+            errors.append((path, "sample needs 'status' for upload to Scout"))
+    return errors
+
+
+def check_family_data(family_data):
+    """Check relationships and Scout requirements of a family.
+
+    Returns:
+        list: (path, message) errors
+    """
+    errors = []
+    samples = [sample_data for sample_data in family_data.get('samples') or []
+               if isinstance(sample_data, dict)]
+    sample_names = {sample_data.get('name') for sample_data in samples if
+                    isinstance(sample_data.get('name'), str)}
+    for sample_data in samples:
+        for parent_key in ('mother', 'father'):
+            parent_id = sample_data.get(parent_key)
+            # ids of other types are reported by the schema
+            if parent_id and isinstance(parent_id, str) and parent_id not in sample_names:
+                errors.append(([family_data.get('name'), sample_data.get('name')],
+                               "sample relation error: {} -> {}".format(parent_key, parent_id)))
+
+    if family_data.get('delivery_type') == 'scout' and 'panels' not in family_data:
+        errors.append(([family_data.get('name')], "family needs 'gene panel' for upload to Scout"))
+    return errors
+
+
+def error_path(project_data, steps):
+    """Describe where in the project data an error was found.
+
+    List indexes are replaced by the family or sample name and the last
+    step is kept if it is a field name.
+    """
+    path = []
+    base = project_data
+    steps = list(steps)
+    for step in steps:
+        if isinstance(step, int):
+            try:
+                path.append(base[step]['name'])
+            except (IndexError, KeyError, TypeError):
+                path.append(str(step))
+        try:
+            base = base[step]
+        except (IndexError, KeyError, TypeError):
+            break
+    if steps and not isinstance(steps[-1], int):
+        path.append(str(steps[-1]))
+    return path
 
 
 def group_containers(project_data):
@@ -193,9 +594,9 @@ def group_containers(project_data):
     return container_groups
 
 
-def make_project(lims_api, project_data, researcher_id='3'):
+def make_project(lims_api, project_data, researcher_id=RESEARCHER_ID):
     """Create a new project with samples."""
-    researcher = Researcher(lims_api, id=researcher_id)
+    researcher = REGISTRY.researcher(lims_api, researcher_id)
     log.info("using researcher: %s", researcher.name)
 
     # create a new LIMS project
@@ -209,24 +610,101 @@ def make_project(lims_api, project_data, researcher_id='3'):
 
 def make_container(lims_api, container_name):
     """Create a new container in LIMS."""
-    if container_name.startswith('tube_'):
-            container_type = Containertype(lims=lims_api, id='2')
-            container_name = container_name.replace('tube_', '')
-    else:
-        container_type = Containertype(lims=lims_api, id='1')
+    container_type, container_name = parse_container(lims_api, container_name)
     lims_container = Container.create(lims=lims_api, name=container_name,
                                       type=container_type)
     log.info("added new LIMS container: %s", lims_container.id)
     return lims_container
 
 
-def make_sample(lims_api, sample_data, lims_project, lims_container):
-    """Create a new sample in LIMS."""
+def make_containers(lims_api, container_names, on_batch=None):
+    """Create new containers in LIMS, batched when LIMS supports it.
+
+    Args:
+        on_batch (Optional[callable]): called with a dict of container group
+            name -> LIMS container after each created batch
+
+    Returns:
+        dict: container group name -> LIMS container
+    """
+    instances = []
+    for container_name in container_names:
+        container_type, name = parse_container(lims_api, container_name)
+        instances.append(Container._create(lims_api, name=name, type=container_type))
+
+    lims_containers = {}
+
+    def created(chunk):
+        chunk = dict(zip(container_names[len(lims_containers):], chunk))
+        for lims_container in chunk.values():
+            log.info("added new LIMS container: %s", lims_container.id)
+        lims_containers.update(chunk)
+        if on_batch:
+            on_batch(chunk)
+
+    try:
+        batch_create(lims_api, Container, instances, on_batch=created)
+    except BatchUnavailableError:
+        log.warning("batch container creation not available, posting one by one")
+        for container_name in container_names:
+            if container_name in lims_containers:
+                # created by a batch before the resource went away
+                continue
+            lims_container = make_container(lims_api, container_name)
+            lims_containers[container_name] = lims_container
+            if on_batch:
+                on_batch({container_name: lims_container})
+    return lims_containers
+
+
+def parse_container(lims_api, container_name):
+    """Determine container type and LIMS name from a container group name."""
+    if container_name.startswith('tube_'):
+        container_type = REGISTRY.container_type(lims_api, CON_TYPES['Tube'])
+        container_name = container_name.replace('tube_', '')
+    else:
+        container_type = REGISTRY.container_type(lims_api, CON_TYPES['96 well plate'])
+    return container_type, container_name
+
+
+def make_samples(lims_api, placements, lims_project, on_batch=None):
+    """Create new samples, batched when LIMS supports it.
+
+    Args:
+        placements (List[tuple]): pairs of sample data and LIMS container
+        on_batch (Optional[callable]): called with a list of pairs of sample
+            data and LIMS sample after each created batch
+    """
+    instances = []
+    for sample_data, lims_container in placements:
+        lims_sample = build_sample(lims_api, sample_data, lims_project)
+        position = sample_data.get('well_position') or '1:1'
+        add_location(lims_sample, lims_container, position)
+        instances.append(lims_sample)
+
+    lims_samples = []
+
+    def created(chunk):
+        start = len(lims_samples)
+        lims_samples.extend(chunk)
+        if on_batch:
+            on_batch([(sample_data, lims_sample) for (sample_data, _), lims_sample in
+                      zip(placements[start:start + len(chunk)], chunk)])
+
+    try:
+        batch_create(lims_api, Sample, instances, on_batch=created)
+    except BatchUnavailableError:
+        log.warning("batch sample creation not available, posting one by one")
+        for lims_sample in instances[len(lims_samples):]:
+            created([post_sample(lims_api, lims_sample)])
+    return lims_samples
+
+
+def build_sample(lims_api, sample_data, lims_project):
+    """Build the XML for a new sample without posting it."""
     lims_sample = Sample._create(lims_api, creation_tag='samplecreation',
                                  name=sample_data['name'], project=lims_project)
     add_sample_udfs(lims_sample, sample_data)
-    position = sample_data.get('well_position') or '1:1'
-    lims_sample = save_sample(lims_api, lims_sample, lims_container, position)
     return lims_sample
 
 
@@ -272,13 +750,50 @@ def add_sample_udfs(lims_sample, sample_data):
     lims_sample.udf['Reference Genome Microbial'] = 'NA'
 
 
-def save_sample(lims_api, instance, container, position):
-    """Create an instance of Sample from attributes then post it to the LIMS"""
+def add_location(instance, container, position):
+    """Place a new sample in a container."""
     location = ElementTree.SubElement(instance.root, 'location')
     ElementTree.SubElement(location, 'container', dict(uri=container.uri))
     position_element = ElementTree.SubElement(location, 'value')
     position_element.text = position
+
+
+def post_sample(lims_api, instance):
+    """Post a single new sample to the LIMS."""
     data = lims_api.tostring(ElementTree.ElementTree(instance.root))
     instance.root = lims_api.post(uri=lims_api.get_uri(Sample._URI), data=data)
     instance._uri = instance.root.attrib['uri']
     return instance
+
+
+def batch_create(lims_api, klass, instances, batch_size=BATCH_SIZE, on_batch=None):
+    """Create new entities in chunks through the LIMS batch resource.
+
+    Returns the created entities in the same order as the input and calls
+    `on_batch` with the entities of each chunk as soon as it's created.
+    Raises `BatchUnavailableError` if the LIMS doesn't expose the batch
+    resource.
+    """
+    uri = lims_api.get_uri(klass._URI, 'batch/create')
+    created = []
+    for start in range(0, len(instances), batch_size):
+        chunk = instances[start:start + batch_size]
+        root = ElementTree.Element(nsmap("{}:details".format(klass._PREFIX)))
+        for instance in chunk:
+            root.append(instance.root)
+        data = lims_api.tostring(ElementTree.ElementTree(root))
+        try:
+            links = lims_api.post(uri=uri, data=data)
+        except HTTPError as error:
+            if is_unavailable(error):
+                raise BatchUnavailableError(uri)
+            raise
+        link_nodes = links.findall('link')
+        if len(link_nodes) != len(chunk):
+            raise ValueError("batch create returned {} links for {} entities"
+                             .format(len(link_nodes), len(chunk)))
+        chunk_created = [klass(lims_api, uri=node.attrib['uri']) for node in link_nodes]
+        created.extend(chunk_created)
+        if on_batch:
+            on_batch(chunk_created)
+    return created
@@ -1,17 +1,38 @@
 # -*- coding: utf-8 -*-
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+import datetime
+import io
+
+import openpyxl
+from openpyxl.utils.datetime import to_excel
 import xlrd
 from cgadmin.lims import SEX_MAP
 
 REV_SEX_MAP = {value: key for key, value in SEX_MAP.items()}
+# columns read by `parse_sample`, everything else in the sheet is skipped
+COLUMNS = (
+    'Sample/Name', 'Container/Type', 'Container/Name', 'Sample/Well Location',
+    'UDF/Data Analysis', 'UDF/Gender', 'UDF/Gene List', 'UDF/Process only if QC OK',
+    'UDF/Quantity', 'UDF/Sequencing Analysis', 'UDF/Source', 'UDF/Status',
+    'UDF/customer', 'UDF/familyID', 'UDF/motherID', 'UDF/fatherID', 'UDF/priority',
+    'UDF/Capture Library version', 'UDF/Comment',
+)
+XLSX_SIGNATURE = b'PK\x03\x04'
+# bump when the output of `parse_orderform` changes, invalidates cached parses
+PARSER_VERSION = 2
+
 
+def parse_orderform(excel_file):
+    """Parse out information from an order form (.xls or .xlsx).
 
-def parse_orderform(excel_path):
-    """Parse out information from an order form."""
-    workbook = xlrd.open_workbook(excel_path)
-    orderform_sheet = workbook.sheet_by_name('orderform')
-    raw_samples = relevant_rows(orderform_sheet)
-    parsed_samples = [parse_sample(raw_sample) for raw_sample in raw_samples]
-    parsed_families = group_families(parsed_samples)
+    Args:
+        excel_file: path, file-like object or bytes of the workbook
+    """
+    with closing(orderform_rows(excel_file)) as rows:
+        raw_samples = relevant_rows(rows)
+        parsed_samples = (parse_sample(raw_sample) for raw_sample in raw_samples)
+        parsed_families = group_families(parsed_samples)
     families = [expand_family(family_id, parsed_family) for
                 family_id, parsed_family in parsed_families.items()]
 
@@ -26,6 +47,34 @@ def parse_orderform(excel_path):
     return new_project
 
 
+def parse_orderforms(excel_paths, processes=None):
+    """Parse many order forms in a pool of processes.
+
+    Yields:
+        tuple: path, project data (None on failure), error message (or None)
+    """
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for excel_path, result in zip(excel_paths, executor.map(try_parse_orderform,
+                                                                excel_paths)):
+            yield (excel_path,) + result
+
+
+def try_parse_orderform(excel_path):
+    """Parse an order form, returning the error message instead of raising."""
+    try:
+        return parse_orderform(excel_path), None
+    except Exception as error:
+        return None, "{}: {}".format(error.__class__.__name__, error)
+
+
+def normalize_project(project_data):
+    """Sort unordered values so the same order form always gives the same JSON."""
+    for family_data in project_data['families']:
+        if 'panels' in family_data:
+            family_data['panels'] = sorted(family_data['panels'])
+    return project_data
+
+
 def expand_family(family_id, parsed_family):
     """Fill-in information about families."""
     new_family = {'name': family_id, 'samples': []}
@@ -124,26 +173,88 @@ def parse_sample(raw_sample):
     return sample
 
 
-def relevant_rows(orderform_sheet):
-    """Get the relevant rows from an order form sheet."""
-    raw_samples = []
+def orderform_rows(excel_file):
+    """Pick a reader for the order form based on the file signature."""
+    if isinstance(excel_file, bytes):
+        excel_file = io.BytesIO(excel_file)
+    if hasattr(excel_file, 'read'):
+        signature = excel_file.read(len(XLSX_SIGNATURE))
+        excel_file.seek(0)
+    else:
+        with open(excel_file, 'rb') as handle:
+            signature = handle.read(len(XLSX_SIGNATURE))
+    if signature == XLSX_SIGNATURE:
+        return xlsx_rows(excel_file)
+    return xls_rows(excel_file)
+
+
+def xls_rows(excel_file):
+    """Iterate over the cell values of the order form sheet in an .xls file."""
+    # only load the order form sheet, not the whole workbook
+    if hasattr(excel_file, 'read'):
+        workbook = xlrd.open_workbook(file_contents=excel_file.read(), on_demand=True)
+    else:
+        workbook = xlrd.open_workbook(excel_file, on_demand=True)
+    try:
+        orderform_sheet = workbook.sheet_by_name('orderform')
+        for row_index in range(orderform_sheet.nrows):
+            yield orderform_sheet.row_values(row_index)
+    finally:
+        workbook.release_resources()
+
+
+def xlsx_rows(excel_file):
+    """Iterate over the cell values of the order form sheet in an .xlsx file.
+
+    The sheet is streamed in read-only mode and values are converted to what
+    xlrd returns for the same cells.
+    """
+    workbook = openpyxl.load_workbook(excel_file, read_only=True, data_only=True)
+    try:
+        orderform_sheet = workbook['orderform']
+        for row in orderform_sheet.iter_rows(values_only=True):
+            yield [xlrd_value(value) for value in row]
+    finally:
+        workbook.close()
+
+
+def xlrd_value(value):
+    """Convert an openpyxl cell value to the xlrd equivalent."""
+    if value is None:
+        return ''
+    elif isinstance(value, bool):
+        return int(value)
+    elif isinstance(value, int):
+        return float(value)
+    elif isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return to_excel(value)
+    return value
+
+
+def relevant_rows(rows):
+    """Get the relevant rows from the cell values of an order form sheet.
+
+    Sample rows are yielded as they are read and reading stops at the end of
+    the sample entries.
+    """
+    header_index = None
     current_row = None
-    for row in orderform_sheet.get_rows():
-        if row[0].value == '</SAMPLE ENTRIES>':
+    for values in rows:
+        first_value = values[0] if values else ''
+        if first_value == '</SAMPLE ENTRIES>':
             break
 
         if current_row == 'header':
-            header_row = [cell.value for cell in row]
+            header_index = [(column, index) for index, column in enumerate(values)
+                            if column in COLUMNS]
             current_row = None
         elif current_row == 'samples':
-            values = [str(cell.value) for cell in row]
-            if values[0]:
-                # skip empty rows
-                sample_dict = dict(zip(header_row, values))
-                raw_samples.append(sample_dict)
+            if first_value != '':
+                # skip empty rows, cells missing from short rows are empty
+                yield {column: str(values[index]) if index < len(values) else ''
+                       for column, index in header_index}
 
-        if row[0].value == '<TABLE HEADER>':
+        if first_value == '<TABLE HEADER>':
             current_row = 'header'
-        elif row[0].value == '<SAMPLE ENTRIES>':
+        elif first_value == '<SAMPLE ENTRIES>':
             current_row = 'samples'
-    return raw_samples
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+import copy
+from xml.etree import ElementTree
+
+from genologics.constants import nsmap
+from requests.exceptions import HTTPError
+
+from cgadmin.fakelims import FakeLims, not_found, split_uri
+from cgadmin.lims import REGISTRY, WORKERS, is_unavailable, new_lims_project
+
+
+class PlanningLims(FakeLims):
+
+    """LIMS API that records what a submission would do without writing.
+
+    Reads are forwarded to the real LIMS while creates and updates are only
+    recorded and simulated in memory so the rest of the submission can run
+    as usual. Batch resources are only simulated if the real LIMS has them
+    and reference entities are served from the registry, like in a warmed
+    worker, without being part of the plan.
+
+    Args:
+        lims_api (ClinicalLims): real LIMS API to read from
+    """
+
+    def __init__(self, lims_api):
+        super(PlanningLims, self).__init__(baseuri=lims_api.baseuri)
+        self.lims_api = lims_api
+        self.operations = []
+        self.batch = None
+        # reference entities are read from the real LIMS through the registry
+        self.entities.clear()
+        REGISTRY.warm(lims_api)
+        self.references = set()
+        for entity in REGISTRY.entities(lims_api):
+            self.entities[entity.uri] = copy.deepcopy(entity.root)
+            self.references.add(entity.uri)
+
+    def get(self, uri, params=dict()):
+        if uri in self.references:
+            return copy.deepcopy(self._lookup(uri))
+        self._call('GET', uri)
+        if uri in self.entities:
+            root = copy.deepcopy(self._lookup(uri))
+        else:
+            root = self.lims_api.get(uri, params=params)
+        self._record('GET', uri, 'read', received=root)
+        return root
+
+    def put(self, uri, data, params=dict()):
+        self._call('PUT', uri)
+        root = ElementTree.fromstring(data)
+        root.attrib['uri'] = uri
+        if uri in self.entities:
+            with self._lock:
+                self.entities[uri] = root
+        self._record('PUT', uri, 'write', sent=data)
+        return copy.deepcopy(root)
+
+    def post(self, uri, data, params=dict()):
+        resource, entity_id, action = split_uri(uri)
+        root = ElementTree.fromstring(data)
+        if action and not self.has_batch(resource):
+            # the submission tries the batch resource once before falling back
+            self._call('POST', uri)
+            self._record('POST', uri, 'unavailable', sent=data, items=len(root))
+            raise not_found(uri)
+        if action == 'batch/retrieve':
+            links = root.findall('link')
+            if any(link.attrib['uri'] in self.entities for link in links):
+                response = super(PlanningLims, self).post(uri, data, params=params)
+            else:
+                self._call('POST', uri)
+                response = self.lims_api.post(uri, data, params=params)
+            self._record('POST', uri, 'read', sent=data, received=response,
+                         items=len(links))
+            return response
+        elif action == 'batch/update':
+            self._call('POST', uri)
+            response = ElementTree.Element(nsmap('ri:links'))
+            for node in list(root):
+                ElementTree.SubElement(response, 'link', dict(uri=node.attrib['uri'],
+                                                              rel=resource))
+            self._record('POST', uri, 'write', sent=data, items=len(root))
+            return response
+        response = super(PlanningLims, self).post(uri, data, params=params)
+        self._record('POST', uri, 'write', sent=data,
+                     items=len(root) if action == 'batch/create' else 1)
+        return response
+
+    def has_batch(self, resource):
+        """Check once if the real LIMS exposes the batch resources."""
+        if self.batch is None:
+            probe_uri = self.lims_api.get_uri(resource, 'batch/retrieve')
+            links = ElementTree.Element(nsmap('ri:links'))
+            try:
+                self.lims_api.post(probe_uri, self.tostring(ElementTree.ElementTree(links)))
+                self.batch = True
+            except HTTPError as error:
+                # anything but a missing resource means it's there
+                self.batch = not is_unavailable(error)
+        return self.batch
+
+    def delete(self, uri, params=dict()):
+        raise ValueError("planning doesn't support deleting: {}".format(uri))
+
+    def _record(self, method, uri, kind, sent=None, received=None, items=None):
+        """Add an operation to the plan."""
+        resource, entity_id, action = split_uri(uri)
+        target = "{}/{}".format(resource, action) if action else resource
+        if isinstance(received, ElementTree.Element):
+            received = self.tostring(ElementTree.ElementTree(received))
+        self.operations.append(dict(
+            method=method,
+            resource=target,
+            kind=kind,
+            items=items or 1,
+            bytes_sent=len(sent or b''),
+            bytes_received=len(received or b''),
+        ))
+
+
+def plan_lims_project(admin_db, lims_api, project_data, workers=WORKERS, journal=None):
+    """Run a submission against the planner and report the operations.
+
+    Nothing is written to LIMS; reads still hit the real LIMS since the plan
+    depends on what already exists there.
+
+    Returns:
+        dict: list of operations and totals per method and resource
+    """
+    planner = PlanningLims(lims_api)
+    new_lims_project(admin_db, planner, project_data, workers=workers, journal=journal)
+    summary = OrderedDict()
+    for operation in planner.operations:
+        key = "{} {}".format(operation['method'], operation['resource'])
+        totals = summary.setdefault(key, dict(kind=operation['kind'], calls=0, items=0,
+                                              bytes_sent=0, bytes_received=0))
+        totals['calls'] += 1
+        for field in ('items', 'bytes_sent', 'bytes_received'):
+            totals[field] += operation[field]
+    return dict(
+        operations=planner.operations,
+        summary=summary,
+        round_trips=len(planner.operations),
+        writes=sum(1 for operation in planner.operations if operation['kind'] == 'write'),
+        bytes_sent=sum(operation['bytes_sent'] for operation in planner.operations),
+        bytes_received=sum(operation['bytes_received'] for operation in planner.operations),
+    )
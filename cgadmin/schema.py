@@ -1,4 +1,11 @@
 # -*- coding: utf-8 -*-
+import copy
+import threading
+import time
+
+from jsonschema import Draft4Validator
+from sqlalchemy import column, func, select, table
+
 from cgadmin import constants
 
 schema_sample = {
@@ -106,3 +113,72 @@ schema_project = {
     },
     "required": ["name", "customer"]
 }
+
+
+def build_schema(customers, apptags):
+    """Copy the project schema and restrict customers and application tags."""
+    schema = copy.deepcopy(schema_project)
+    schema['properties']['customer'] = {"enum": sorted(customers)}
+    sample_properties = (schema['properties']['families']['items']['properties']
+                               ['samples']['items']['properties'])
+    sample_properties['application_tag'] = {"enum": sorted(apptags)}
+    return schema
+
+
+class ValidatorCache(object):
+
+    """Compiled project validator, rebuilt when the catalog changes.
+
+    Before each use the number and highest id of customers and application
+    tags are compared with the ones the validator was built from, which
+    catches additions and deletions by any process. `bump` is called when
+    a customer or application tag is saved or deleted in this process, and
+    other changes (like renames elsewhere) are picked up after `max_age`
+    seconds.
+    """
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self.version = 0
+        self._validator = None
+        self._built = (None, None, 0)
+        self._lock = threading.Lock()
+
+    def bump(self):
+        """Mark the catalog as changed."""
+        with self._lock:
+            self.version += 1
+
+    def validator(self, admin_db):
+        """Get the validator for the current catalog."""
+        db_version = catalog_version(admin_db)
+        with self._lock:
+            built_version, built_db_version, built_at = self._built
+            if (self._validator is None or built_version != self.version or
+                    built_db_version != db_version or
+                    time.time() - built_at > self.max_age):
+                schema = build_schema(*load_catalog(admin_db))
+                self._validator = Draft4Validator(schema)
+                self._built = (self.version, db_version, time.time())
+            return self._validator
+
+
+def catalog_version(admin_db):
+    """Count and highest id of customers and application tags, in one query."""
+    columns = []
+    for table_name in ('customer', 'applicationtag'):
+        id_column = column('id')
+        catalog_table = table(table_name, id_column)
+        for aggregate in (func.count(id_column), func.max(id_column)):
+            columns.append(select([aggregate]).select_from(catalog_table).as_scalar())
+    return tuple(admin_db.session.execute(select(columns)).first())
+
+
+def load_catalog(admin_db):
+    """Fetch all customer ids and application tag names."""
+    customers = [customer.customer_id for customer in admin_db.Customer]
+    apptags = [apptag.name for apptag in admin_db.ApplicationTag]
+    return customers, apptags
+
+
+VALIDATORS = ValidatorCache()
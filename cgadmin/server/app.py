@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import copy
 import datetime
 import os
 import tempfile
@@ -7,25 +8,27 @@ from cglims.api import ClinicalLims
 from cglims.apptag import ApplicationTag
 import coloredlogs
 from flask import (abort, Flask, render_template, request, redirect, url_for,
-                   flash, jsonify, send_from_directory)
+                   flash, jsonify, send_file, send_from_directory)
 from flask_admin import Admin
 from flask_admin.contrib.sqla import ModelView
 from flask_bootstrap import Bootstrap
 from flask_login import current_user, login_required
-from jsonschema import ValidationError
-from werkzeug.utils import secure_filename
+from itsdangerous import BadSignature, URLSafeSerializer
 
-from cgadmin import constants
+from cgadmin import constants, jobs, lims
+from cgadmin.lims import SubmissionError
 from cgadmin.store import models
+from cgadmin.store.files import FileStore
 from cgadmin.store.parse import parse_db_project
-from cgadmin.lims import new_lims_project, GENDER_MAP
-from cgadmin.orderform import parse_orderform
+from cgadmin.plan import plan_lims_project
 from cgadmin.invoice.render import render_xlsx
 from .admin import UserManagement
-from .flask_sqlservice import FlaskSQLService
+from .flask_sqlservice import AdminSQLService
+from .instrument import Instrument
+from .lims_cache import CaseCache
+from .orderform_cache import OrderformCache
 from .publicbp import blueprint as public_bp
 from .mailgun import Mailgun
-from .osticket import OsTicket
 
 
 coloredlogs.install(level='INFO')
@@ -47,30 +50,48 @@ MAILGUN_API_KEY = os.environ['MAILGUN_API_KEY']
 MAILGUN_DOMAIN_NAME = os.environ['MAILGUN_DOMAIN_NAME']
 OSTICKET_API_KEY = os.environ['OSTICKET_API_KEY']
 OSTICKET_DOMAIN = os.environ['OSTICKET_DOMAIN']
+LIMS_WORKERS = int(os.environ.get('CGADMIN_LIMS_WORKERS', lims.WORKERS))
+LIMS_CASE_TTL = int(os.environ.get('CGADMIN_LIMS_CASE_TTL', 300))
+LIMS_CASE_CACHE_SIZE = int(os.environ.get('CGADMIN_LIMS_CASE_CACHE_SIZE', 1024))
+ORDERFORM_MAX_SIZE = int(os.environ.get('CGADMIN_ORDERFORM_MAX_SIZE', 10 * 1024 * 1024))
+ORDERFORM_CACHE_SIZE = int(os.environ.get('CGADMIN_ORDERFORM_CACHE_SIZE', 32))
+ORDERFORM_CACHE_DIR = os.environ.get('CGADMIN_ORDERFORM_CACHE_DIR')
+FILE_STORE_DIR = (os.environ.get('CGADMIN_FILE_STORE_DIR') or
+                  os.path.join(app.instance_path, 'files'))
 
 app.config.from_object(__name__)
 
-db = FlaskSQLService(model_class=models.Model)
+db = AdminSQLService(model_class=models.Model)
 user = UserManagement(db)
 admin = Admin(name='Clinical Admin', template_mode='bootstrap3')
 lims_api = ClinicalLims(CGLIMS_HOST, CGLIMS_USERNAME, CGLIMS_PASSWORD)
+file_store = FileStore(FILE_STORE_DIR)
+case_cache = CaseCache(lims_api)
 mail = Mailgun()
-osticket = OsTicket()
+orderform_cache = OrderformCache()
+instrument = Instrument()
+instrument.track('lims', lims_api, 'get', 'put', 'post', response_method='parse_response')
+instrument.track('mailgun', mail, 'send')
 
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
     if not current_user.is_authenticated:
         return render_template('index.html')
+    orderform_jobs = None
     if current_user.customers:
-        customers = db.Customer.find() if current_user.is_admin else current_user.customers
-        customer_ids = [customer.id for customer in customers]
-        proj_q = (db.Project.filter(models.Project.customer_id.in_(customer_ids))
-                            .order_by(models.Project.created_at.desc()).limit(50))
+        if current_user.is_admin:
+            customers = db.customer_choices()
+            projects = db.project_overview()
+        else:
+            customers = current_user.customers
+            projects = db.project_overview([customer.id for customer in customers])
+        orderform_jobs = jobs.orderform_jobs(db, user_id=current_user.id)
     else:
-        customers = db.Customer.find()
-        proj_q = None
-    return render_template('projects.html', projects=proj_q, customers=customers)
+        customers = db.customer_choices()
+        projects = None
+    return render_template('projects.html', projects=projects, customers=customers,
+                           orderform_jobs=orderform_jobs)
 
 
 @app.route('/users/<int:user_id>/link', methods=['POST'])
@@ -91,29 +112,37 @@ def link_customers(user_id):
 @login_required
 def project(project_id):
     """View a project."""
-    project_obj = db.Project.get(project_id)
+    project_obj = db.project_graph(project_id)
     if request.method == 'POST':
         project_data = build_project()
+        new_customer = project_data['customer']
+        if new_customer.id != project_obj.customer_id:
+            # family names have to be unique for the new customer too
+            duplicates = db.duplicate_families(new_customer.id, [
+                family_obj.name for family_obj in project_obj.families if
+                not family_obj.existing_family])
+            if duplicates:
+                flash("{} already has families named: {}".format(
+                      new_customer.name, ', '.join(sorted(duplicates))), 'danger')
+                return redirect(url_for('project', project_id=project_obj.id))
         project_obj.update(project_data)
         project_obj = db.Project.save(project_obj)
         flash("project: {} updated".format(project_obj.name), 'info')
         return redirect(url_for('project', project_id=project_obj.id))
 
-    apptags = db.ApplicationTag.order_by('category')
-    for family_obj in project_obj.families:
-        if family_obj.existing_family:
-            # fetch information about existing samples from LIMS
-            lims_samples = lims_api.case(project_obj.customer.customer_id, family_obj.name)
-            samples_data = [dict(
-                name=sample.name,
-                sex=GENDER_MAP.get(sample.udf.get('Gender')),
-                status=sample.udf.get('Status'),
-                father=sample.udf.get('fatherID'),
-                mother=sample.udf.get('motherID'),
-            ) for sample in lims_samples]
-            family_obj.existing_samples = samples_data
+    apptags = db.ApplicationTag.order_by('category').all()
+    # fetch information about existing samples from LIMS
+    customer_id = project_obj.customer.customer_id
+    existing_families = [family_obj for family_obj in project_obj.families
+                         if family_obj.existing_family]
+    if existing_families:
+        expire_cases()
+    cases = case_cache.get_many([(customer_id, family_obj.name) for
+                                 family_obj in existing_families])
+    for family_obj in existing_families:
+        family_obj.existing_samples = cases[(customer_id, family_obj.name)]
     return render_template('project.html', project=project_obj, apptags=apptags,
-                           form=request.form)
+                           form=request.form, job=jobs.latest_job(db, project_obj.id))
 
 
 @app.route('/projects', methods=['POST'])
@@ -122,15 +151,17 @@ def projects():
     """Add a new project to the database."""
     if request.method == 'POST' and request.files['orderform']:
         project_data = collect_project_data()
-        lims_project = submit_lims_project(project_data)
-        if not lims_project:
-            flash("couldn't create project from order form", 'danger')
+        try:
+            # validation adds references to the data, keep the original for the job
+            lims.validate_project(db, copy.deepcopy(project_data))
+        except SubmissionError as error:
+            for message in error.args[0].splitlines():
+                flash(message, 'danger')
             return redirect(url_for('index'))
-        if not lims_project.name.isdigit():
-            ticket_id = open_ticket(lims_project.name)
-            lims_project.name = ticket_id
-            lims_project.put()
-            flash("opened new ticket for project: {}".format(ticket_id), 'info')
+        job_obj = jobs.enqueue(db, project_data, user=job_user())
+        invalidate_cases(project_data)
+        flash("queued submission of {} as job {}".format(project_data['name'], job_obj.id),
+              'info')
         return redirect(url_for('index'))
 
     project_data = build_project()
@@ -150,22 +181,23 @@ def delete_project(project_id):
 @app.route('/projects/<int:project_id>/submit', methods=['POST'])
 @login_required
 def submit_project(project_id):
-    """Submit and lock a project."""
-    project_obj = db.Project.get(project_id)
+    """Queue a project for submission, it's locked once it's in LIMS."""
+    project_obj = db.project_graph(project_id)
+    if project_obj.is_locked or jobs.active_job(db, project_obj.id):
+        flash("project already submitted: {}".format(project_obj.name), 'warning')
+        return redirect(url_for('project', project_id=project_obj.id))
     project_data = parse_db_project(project_obj)
-    lims_project = submit_lims_project(project_data)
-    if lims_project:
-        ticket_id = open_ticket(lims_project.name)
-        lims_project.name = ticket_id
-        lims_project.put()
-        flash("opened new ticket for project: {}".format(ticket_id), 'info')
-
-        project_obj.is_locked = True
-        project_obj.lims_id = lims_project.id
-        db.Project.save(project_obj)
-        return redirect(url_for('index'))
-    else:
+    try:
+        # validation adds references to the data, keep the original for the job
+        lims.validate_project(db, copy.deepcopy(project_data))
+    except SubmissionError as error:
+        for message in error.args[0].splitlines():
+            flash(message, 'danger')
         return redirect(url_for('project', project_id=project_obj.id))
+    job_obj = jobs.enqueue(db, project_data, user=job_user(), project=project_obj)
+    invalidate_cases(project_data)
+    flash("queued submission of {} as job {}".format(project_obj.name, job_obj.id), 'info')
+    return redirect(url_for('index'))
 
 
 @app.route('/projects/<int:project_id>/families', methods=['POST'])
@@ -182,7 +214,7 @@ def families(project_id):
         return redirect(request.referrer)
 
     try:
-        new_family = db.Family.save(family_data)
+        new_family = db.save_family(models.Family(**family_data))
     except models.DuplicateFamilyNameError as error:
         flash("detected duplicate family name: {}".format(error), 'danger')
         return redirect(url_for('project', project_id=project_obj.id))
@@ -204,7 +236,11 @@ def family(family_id):
         except ValueError:
             return redirect(request.referrer)
     family_obj.update(family_data)
-    db.Family.save(family_obj)
+    try:
+        db.save_family(family_obj)
+    except models.DuplicateFamilyNameError as error:
+        flash("detected duplicate family name: {}".format(error), 'danger')
+        return redirect(url_for('project', project_id=family_obj.project.id))
     flash("family: {} updated".format(family_obj.name), 'info')
     return redirect(url_for('project', project_id=family_obj.project.id))
 
@@ -253,27 +289,82 @@ def samples(family_id=None, sample_id=None):
         flash("sample: {} updated".format(sample_obj.name), 'info')
         return redirect(url_for('project', project_id=family_obj.project.id))
     else:
-        apptags = db.ApplicationTag.order_by('category')
+        apptags = db.ApplicationTag.order_by('category').all()
         return render_template('project.html', project=family_obj.project,
                                apptags=apptags, form=request.form)
 
 
 @app.route('/api/v1/projects', methods=['POST'])
 def api_projects():
-    """Submit new projects to LIMS."""
+    """Submit new projects to LIMS.
+
+    With `?plan=true` the LIMS operations are only listed, nothing is written.
+    """
     project_data = request.get_json()
     try:
-        lims_project = new_lims_project(db, lims_api, project_data)
-    except ValidationError as error:
-        flash(error.message, 'error')
-        return abort(406)
-    return jsonify(success=True, project_id=lims_project.id)
+        # validation adds references to the data, keep the original for the job
+        lims.validate_project(db, copy.deepcopy(project_data))
+    except SubmissionError as error:
+        errors = [dict(path=path, message=message) for path, message in error.errors]
+        return jsonify(success=False, message=error.args[0], errors=errors), 406
+    if request.args.get('plan') in ('true', '1', 'yes'):
+        try:
+            lims_plan = plan_lims_project(db, lims_api, project_data,
+                                          workers=app.config['LIMS_WORKERS'])
+        except ValueError as error:
+            return jsonify(success=False, message=error.args[0]), 406
+        return jsonify(success=True, **lims_plan)
+    job_obj = jobs.enqueue(db, project_data, user=job_user(), open_ticket=False)
+    invalidate_cases(project_data)
+    return jsonify(success=True, job_id=job_obj.id,
+                   status_url=url_for('api_job', token=job_token(job_obj.id),
+                                      _external=True)), 202
+
+
+@app.route('/api/v1/jobs/<token>')
+def api_job(token):
+    """Report the status of a job submitted through the API.
+
+    The token in the status URL is only handed out to the submitter.
+    """
+    try:
+        job_id = job_serializer().loads(token)
+    except BadSignature:
+        return abort(404, "job not found")
+    return job_status(job_id)
+
+
+@app.route('/jobs/<int:job_id>')
+@login_required
+def job(job_id):
+    """Report status and per-stage progress of a submission job."""
+    return job_status(job_id)
+
+
+def job_status(job_id):
+    """Describe a submission job as JSON."""
+    job_obj = db.Job.get(job_id)
+    if job_obj is None:
+        return abort(404, "job not found")
+    return jsonify(
+        id=job_obj.id,
+        status=job_obj.status,
+        stage=job_obj.stage,
+        progress=job_obj.progress,
+        message=job_obj.message,
+        project_id=job_obj.project_id,
+        lims_id=job_obj.lims_id,
+        ticket_id=job_obj.ticket_id,
+        created_at=job_obj.created_at.isoformat() if job_obj.created_at else None,
+        started_at=job_obj.started_at.isoformat() if job_obj.started_at else None,
+        finished_at=job_obj.finished_at.isoformat() if job_obj.finished_at else None,
+    )
 
 
 @app.route('/invoices')
 def invoices():
     """Display invoices."""
-    invoice_q = (db.Invoice.filter(models.Invoice._data != None)
+    invoice_q = (db.Invoice.filter(models.Invoice._packed_data != None)
                    .order_by(models.Invoice.invoiced_at.desc()))
     return render_template('invoices.html', invoices=invoice_q)
 
@@ -284,6 +375,11 @@ def invoice(invoice_id):
     invoice_obj = db.Invoice.get(invoice_id)
     if request.method == 'POST':
         invoice_obj.comment = request.form.get('comment') or invoice_obj.comment
+        for costcenter in ('kth', 'ki'):
+            excel_file = request.files.get("excel-{}".format(costcenter))
+            if excel_file and excel_file.filename:
+                checksum = file_store.put(excel_file.stream)
+                setattr(invoice_obj, "excel_{}_checksum".format(costcenter), checksum)
         db.Invoice.save(invoice_obj)
         flash("updated invoice information for: {}".format(invoice_obj.invoice_id), 'info')
     return render_template('invoice.html', invoice=invoice_obj, data=invoice_obj.data)
@@ -302,12 +398,21 @@ def invoice_send(invoice_id):
 def invoice_dl(invoice_id, costcenter):
     """Download Excel version of an invoice."""
     invoice_obj = db.Invoice.get(invoice_id)
+    fname = "Invoice_{}_{}.xlsx".format(invoice_obj.invoice_id, costcenter.upper())
+    checksum = getattr(invoice_obj, "excel_{}_checksum".format(costcenter), None)
+    if checksum:
+        # serve the modified invoice as uploaded
+        if not file_store.exists(checksum):
+            return abort(404, "uploaded invoice file is missing: {}".format(checksum))
+        return send_file(file_store.path(checksum), as_attachment=True, download_name=fname,
+                         mimetype=('application/vnd.openxmlformats-officedocument.'
+                                   'spreadsheetml.sheet'))
+
     data = invoice_obj.data
     data['project'] = getattr(invoice_obj.customer, "project_account_{}".format(costcenter))
     workbook = render_xlsx(data, costcenter)
 
     temp_dir = tempfile.gettempdir()
-    fname = "Invoice_{}_{}.xlsx".format(invoice_obj.invoice_id, costcenter.upper())
     excel_path = os.path.join(temp_dir, fname)
     workbook.save(excel_path)
 
@@ -323,7 +428,9 @@ user.init_app(app)
 Bootstrap(app)
 admin.init_app(app)
 mail.init_app(app)
-osticket.init_app(app)
+instrument.init_app(app)
+case_cache.init_app(app)
+orderform_cache.init_app(app)
 
 app.jinja_env.globals.update(db=db, constants=constants)
 
@@ -332,35 +439,64 @@ def collect_project_data():
     """Collect data about a project submission."""
     excel_file = request.files['orderform']
     project_name = request.form['name']
-    filename = secure_filename(excel_file.filename)
-    temp_dir = tempfile.gettempdir()
-    saved_path = os.path.join(temp_dir, filename)
-    excel_file.save(saved_path)
-    project_data = parse_orderform(saved_path)
+    with spool_upload(excel_file, app.config['ORDERFORM_MAX_SIZE']) as buffer:
+        project_data = orderform_cache.parse(buffer)
     project_data['name'] = project_name
     return project_data
 
 
-def submit_lims_project(project_data):
-    """Handle submission of project to LIMS in Flask context."""
-    try:
-        lims_project = new_lims_project(db, lims_api, project_data)
-    except ValidationError as error:
-        message_path = []
-        base = project_data
-        for step in error.absolute_path:
-            if isinstance(step, int):
-                message_path.append(base[step]['name'])
-            base = base[step]
-        message_path.append(step)
-        message_path.append(error.message)
-        flash(' -> '.join(message_path), 'danger')
-        return False
-    except ValueError as error:
-        flash(error.args[0], 'danger')
-        return False
-    flash("submitted new project: {}!".format(lims_project.id), 'success')
-    return lims_project
+def spool_upload(file_storage, max_size, chunk_size=64 * 1024):
+    """Copy an upload into an in-memory buffer, refusing files over `max_size`."""
+    buffer = tempfile.SpooledTemporaryFile(max_size=max_size)
+    size = 0
+    while True:
+        chunk = file_storage.stream.read(chunk_size)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_size:
+            buffer.close()
+            abort(413, "order form is larger than {} bytes".format(max_size))
+        buffer.write(chunk)
+    buffer.seek(0)
+    return buffer
+
+
+def job_serializer():
+    """Sign job ids for the status URLs of API submissions."""
+    return URLSafeSerializer(app.config['SECRET_KEY'], salt='job-status')
+
+
+def job_token(job_id):
+    """Get the token for the status URL of a job."""
+    return job_serializer().dumps(job_id)
+
+
+def job_user():
+    """Return the logged in user to attach to a job."""
+    user_obj = current_user._get_current_object()
+    return user_obj if isinstance(user_obj, models.User) else None
+
+
+def invalidate_cases(project_data, before=None):
+    """Drop cached LIMS samples for families we might have written to."""
+    project_data = project_data or {}
+    for family_data in project_data.get('families', []):
+        case_cache.invalidate(project_data.get('customer'), family_data.get('name'),
+                              before=before)
+
+
+def expire_cases():
+    """Drop cached LIMS samples of families written by jobs that have finished.
+
+    The worker writes to LIMS in another process so samples cached before a
+    job finished might be out of date. Jobs are checked with a minute of
+    overlap since `finished_at` is set a moment before the job is committed.
+    """
+    since = case_cache.jobs_checked_at - datetime.timedelta(minutes=1)
+    for job_obj in db.Job.filter(models.Job.finished_at > since):
+        invalidate_cases(job_obj.data, before=job_obj.finished_at.timestamp())
+        case_cache.jobs_checked_at = max(case_cache.jobs_checked_at, job_obj.finished_at)
 
 
 class ProtectedModelView(ModelView):
@@ -379,7 +515,7 @@ class ApplicationTagVersionView(ProtectedModelView):
 
 class InvoiceView(ProtectedModelView):
     column_filters = ('customer', 'costcenter')
-    column_exclude_list = ('_data')
+    column_exclude_list = ('_packed_data',)
 
 
 with app.app_context():
@@ -390,8 +526,9 @@ with app.app_context():
     admin.add_view(ProtectedModelView(models.Sample, db.session))
     admin.add_view(ProtectedModelView(models.ApplicationTag, db.session))
     admin.add_view(ApplicationTagVersionView(models.ApplicationTagVersion, db.session))
-    admin.add_view(ProtectedModelView(models.Invoice, db.session))
+    admin.add_view(InvoiceView(models.Invoice, db.session))
     admin.add_view(ProtectedModelView(models.Method, db.session))
+    admin.add_view(ProtectedModelView(models.Job, db.session))
 
 
 def build_project():
@@ -524,14 +661,3 @@ def check_samplename(customer_id, sample_name, expect_sample=False):
     elif not expect_sample and len(lims_samples) > 0:
         flash("sample name already exists: {}".format(sample_name), 'danger')
         return redirect(request.referrer)
-
-
-def open_ticket(project_name):
-    """Open a new ticket in SupportSystem for a LIMS project."""
-    ticket_id = osticket.open_ticket(
-        name=current_user.name,
-        email=current_user.email,
-        subject=project_name,
-        message="New samples submitted",
-    )
-    return ticket_id
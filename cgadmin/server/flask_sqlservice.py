@@ -2,6 +2,8 @@
 from flask import current_app, _app_ctx_stack
 from sqlservice import SQLClient
 
+from cgadmin.store.api import AdminApi
+
 
 class FlaskSQLService(object):
 
@@ -55,3 +57,8 @@ class FlaskSQLService(object):
     def __getattr__(self, attr):
         """Proxy attribute access to SQLClient instance."""
         return getattr(current_app.extensions['sqlservice'], attr)
+
+
+class AdminSQLService(AdminApi, FlaskSQLService):
+
+    """Flask extension with the shared admin queries."""
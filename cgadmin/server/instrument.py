@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+import functools
+import logging
+import threading
+import time
+
+from flask import g, has_request_context, request
+import requests
+
+log = logging.getLogger(__name__)
+
+
+class CallStats(object):
+
+    """Count, errors, latency and bytes of outgoing calls per service."""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.services = {}
+        self._lock = threading.Lock()
+
+    def add(self, service, duration, bytes_sent=0, bytes_received=0, failed=False):
+        with self._lock:
+            stats = self.services.setdefault(service, dict(calls=0, errors=0, duration=0.0,
+                                                           bytes_sent=0, bytes_received=0))
+            stats['calls'] += 1
+            stats['errors'] += 1 if failed else 0
+            stats['duration'] += duration
+            stats['bytes_sent'] += bytes_sent
+            stats['bytes_received'] += bytes_received
+
+
+class Instrument(object):
+
+    """Record outgoing API calls made while handling a Flask request.
+
+    Client methods are wrapped with `track`. The totals per service are sent
+    back in a `Server-Timing` header and logged as one line per request.
+    Failed calls are recorded too. Calls made from worker threads are only
+    attributed to a request if the function is wrapped with `bind`.
+    """
+
+    def __init__(self, app=None):
+        super(Instrument, self).__init__()
+        self._local = threading.local()
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize with Flask app object."""
+        app.extensions['instrument'] = self
+        app.before_request(self._start)
+        app.after_request(self._finish)
+
+    def track(self, service, client, *methods, response_method=None):
+        """Wrap methods of an API client so each call is recorded.
+
+        Args:
+            response_method (Optional[str]): method of the client that is
+                passed the `requests.Response` of a call, used for byte counts
+                when the tracked methods don't return the response
+        """
+        for method in methods:
+            func = getattr(client, method)
+            setattr(client, method, self._wrap(service, func))
+        if response_method:
+            func = getattr(client, response_method)
+            setattr(client, response_method, self._keep_response(func))
+        return client
+
+    def bind(self, func):
+        """Attribute calls from `func` to the current request in other threads."""
+        stats = self.current()
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            previous = getattr(self._local, 'stats', None)
+            self._local.stats = stats
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._local.stats = previous
+        return wrapper
+
+    def current(self):
+        """Get the stats of the request the current thread is working for."""
+        stats = getattr(self._local, 'stats', None)
+        if stats is None and has_request_context():
+            stats = g.get('call_stats')
+        return stats
+
+    def _wrap(self, service, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            self._local.response = None
+            start = time.time()
+            result, error = None, None
+            try:
+                result = func(*args, **kwargs)
+                return result
+            except Exception as exc:
+                error = exc
+                raise
+            finally:
+                self._record(service, time.time() - start, args, result, error)
+        return wrapper
+
+    def _keep_response(self, func):
+        @functools.wraps(func)
+        def wrapper(response, *args, **kwargs):
+            self._local.response = response
+            return func(response, *args, **kwargs)
+        return wrapper
+
+    def _record(self, service, duration, args, result, error):
+        stats = self.current()
+        response = getattr(self._local, 'response', None)
+        self._local.response = None
+        if stats is None:
+            return
+        bytes_sent, bytes_received = 0, 0
+        if response is None:
+            response = next((value for value in args + (result,) if
+                             isinstance(value, requests.Response)), None)
+        if response is None and error is not None:
+            response = getattr(error, 'response', None)
+        if isinstance(response, requests.Response):
+            if response in args:
+                # the request was made before the wrapped call
+                duration += response.elapsed.total_seconds()
+            bytes_sent = len(response.request.body or b'') if response.request else 0
+            bytes_received = len(response.content or b'')
+        elif isinstance(result, str):
+            bytes_received = len(result)
+        stats.add(service, duration, bytes_sent, bytes_received, failed=error is not None)
+
+    def _start(self):
+        g.call_stats = CallStats()
+
+    def _finish(self, response):
+        stats = g.get('call_stats')
+        if stats is None:
+            return response
+        total = time.time() - stats.started_at
+        timings = ["{};dur={:.1f};desc=\"{} calls\"".format(service, values['duration'] * 1000,
+                                                           values['calls'])
+                   for service, values in sorted(stats.services.items())]
+        timings.append("total;dur={:.1f}".format(total * 1000))
+        response.headers.add('Server-Timing', ', '.join(timings))
+
+        fields = ["method={}".format(request.method), "path={}".format(request.path),
+                  "endpoint={}".format(request.endpoint), "status={}".format(response.status_code),
+                  "duration_ms={:.1f}".format(total * 1000)]
+        for service, values in sorted(stats.services.items()):
+            fields.extend([
+                "{}_calls={}".format(service, values['calls']),
+                "{}_errors={}".format(service, values['errors']),
+                "{}_ms={:.1f}".format(service, values['duration'] * 1000),
+                "{}_bytes_sent={}".format(service, values['bytes_sent']),
+                "{}_bytes_received={}".format(service, values['bytes_received']),
+            ])
+        log.info(' '.join(fields))
+        return response
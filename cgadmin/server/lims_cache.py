@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import threading
+import time
+
+from cgadmin.lims import GENDER_MAP, WORKERS, batch_retrieve
+
+
+class CaseCache(object):
+
+    """Time-limited cache of LIMS samples per customer family.
+
+    Entries are keyed by (customer id, family name) and must be invalidated
+    whenever we write to LIMS for that family. At most `size` families are
+    kept, the least recently used are evicted first. A fetch that overlaps
+    an invalidation of its family isn't cached since it may be stale.
+    """
+
+    def __init__(self, lims_api, app=None):
+        super(CaseCache, self).__init__()
+        self.lims_api = lims_api
+        self.ttl = 300
+        self.size = 1024
+        self.workers = WORKERS
+        self.instrument = None
+        # finish time of the latest submission job checked for invalidation
+        self.jobs_checked_at = datetime.now()
+        self._entries = OrderedDict()
+        # invalidation counters and number of fetches of families being fetched
+        self._generations = {}
+        self._fetching = Counter()
+        self._lock = threading.Lock()
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize with Flask app object."""
+        self.ttl = app.config.get('LIMS_CASE_TTL', self.ttl)
+        self.size = app.config.get('LIMS_CASE_CACHE_SIZE', self.size)
+        self.workers = app.config.get('LIMS_WORKERS', self.workers)
+        self.instrument = app.extensions.get('instrument')
+
+    def get(self, customer_id, family_name):
+        """Get samples for a single family."""
+        return self.get_many([(customer_id, family_name)])[(customer_id, family_name)]
+
+    def get_many(self, keys):
+        """Get samples for multiple families, fetching misses concurrently."""
+        now = time.time()
+        results = {}
+        started = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry and now - entry[0] < self.ttl:
+                    self._entries.move_to_end(key)
+                    results[key] = entry[1]
+                elif key not in started:
+                    if entry:
+                        del self._entries[key]
+                    started[key] = self._generations.get(key, 0)
+                    self._fetching[key] += 1
+        if started:
+            missing = list(started)
+            fetch = self.instrument.bind(self._fetch) if self.instrument else self._fetch
+            fetched = []
+            try:
+                with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                    fetched = list(executor.map(fetch, missing))
+            finally:
+                with self._lock:
+                    for key, samples_data in zip(missing, fetched):
+                        results[key] = samples_data
+                        if self._generations.get(key, 0) == started[key]:
+                            self._entries[key] = (now, samples_data)
+                            self._entries.move_to_end(key)
+                    for key in missing:
+                        self._fetching[key] -= 1
+                        if self._fetching[key] <= 0:
+                            del self._fetching[key]
+                            self._generations.pop(key, None)
+                    while len(self._entries) > self.size:
+                        self._entries.popitem(last=False)
+        return results
+
+    def invalidate(self, customer_id, family_name, before=None):
+        """Drop cached samples for a family.
+
+        Args:
+            before (Optional[float]): only drop samples cached before this time
+        """
+        key = (customer_id, family_name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and (before is None or entry[0] < before):
+                del self._entries[key]
+            if key in self._fetching:
+                # results of fetches running now must not be cached
+                self._generations[key] = self._generations.get(key, 0) + 1
+
+    def clear(self):
+        """Drop all cached families."""
+        with self._lock:
+            self._entries.clear()
+            for key in self._fetching:
+                self._generations[key] = self._generations.get(key, 0) + 1
+
+    def _fetch(self, key):
+        """Fetch samples for a family from LIMS, bypassing the client cache."""
+        customer_id, family_name = key
+        lims_samples = self.lims_api.case(customer_id, family_name)
+        batch_retrieve(self.lims_api, lims_samples, force=True)
+        samples_data = [dict(
+            name=sample.name,
+            sex=GENDER_MAP.get(sample.udf.get('Gender')),
+            status=sample.udf.get('Status'),
+            father=sample.udf.get('fatherID'),
+            mother=sample.udf.get('motherID'),
+        ) for sample in lims_samples]
+        return samples_data
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+import copy
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from cgadmin.orderform import PARSER_VERSION, parse_orderform
+from cgadmin.store.files import atomic_write
+
+log = logging.getLogger(__name__)
+
+
+class OrderformCache(object):
+
+    """Parsed order forms keyed by the SHA-256 of the uploaded bytes.
+
+    The most recently used results are kept in memory and, if a cache
+    directory is configured, also written there as JSON so they survive
+    restarts. Files are kept in a subdirectory per parser version so parses
+    from an older parser are never reused.
+    """
+
+    def __init__(self, app=None):
+        super(OrderformCache, self).__init__()
+        self.size = 32
+        self.directory = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize with Flask app object."""
+        self.size = app.config.get('ORDERFORM_CACHE_SIZE', self.size)
+        self.directory = app.config.get('ORDERFORM_CACHE_DIR') or None
+        if self.directory:
+            self.directory = os.path.join(self.directory, "v{}".format(PARSER_VERSION))
+        if self.directory and not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def parse(self, excel_file):
+        """Parse an order form file object, reusing earlier results."""
+        checksum = file_checksum(excel_file)
+        project_data = self.get(checksum)
+        if project_data is None:
+            project_data = parse_orderform(excel_file)
+            self.set(checksum, project_data)
+        else:
+            log.debug("reusing parsed order form: %s", checksum)
+        return project_data
+
+    def get(self, checksum):
+        """Get a copy of a cached result."""
+        with self._lock:
+            project_data = self._entries.get(checksum)
+            if project_data is not None:
+                self._entries.move_to_end(checksum)
+        if project_data is None and self.directory:
+            project_data = self._load(checksum)
+            if project_data is not None:
+                self._remember(checksum, project_data)
+        return copy.deepcopy(project_data)
+
+    def set(self, checksum, project_data):
+        """Cache a parsed order form."""
+        project_data = copy.deepcopy(project_data)
+        self._remember(checksum, project_data)
+        if self.directory:
+            self._dump(checksum, project_data)
+
+    def clear(self):
+        """Drop all results kept in memory."""
+        with self._lock:
+            self._entries.clear()
+
+    def _remember(self, checksum, project_data):
+        with self._lock:
+            self._entries[checksum] = project_data
+            self._entries.move_to_end(checksum)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def _path(self, checksum):
+        return os.path.join(self.directory, "{}.json".format(checksum))
+
+    def _load(self, checksum):
+        try:
+            with open(self._path(checksum)) as handle:
+                return json.load(handle)
+        except (IOError, ValueError):
+            return None
+
+    def _dump(self, checksum, project_data):
+        with atomic_write(self._path(checksum), mode='w') as temp_file:
+            json.dump(project_data, temp_file)
+
+
+def file_checksum(excel_file, chunk_size=64 * 1024):
+    """Calculate the SHA-256 of a file object and rewind it."""
+    sha = hashlib.sha256()
+    for chunk in iter(lambda: excel_file.read(chunk_size), b''):
+        sha.update(chunk)
+    excel_file.seek(0)
+    return sha.hexdigest()
@@ -15,8 +15,12 @@ class OsTicket(object):
 
     def init_app(self, app):
         """Initialize the API."""
-        self.headers = {'X-API-Key': app.config['OSTICKET_API_KEY']}
-        self.url = os.path.join(app.config['OSTICKET_DOMAIN'], 'api/tickets.json')
+        self.setup(app.config['OSTICKET_API_KEY'], app.config['OSTICKET_DOMAIN'])
+
+    def setup(self, api_key, domain):
+        """Initialize the API outside of Flask."""
+        self.headers = {'X-API-Key': api_key}
+        self.url = os.path.join(domain, 'api/tickets.json')
 
     def open_ticket(self, name, email, subject, message):
         """Open a new ticket through the REST API."""
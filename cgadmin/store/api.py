@@ -1,14 +1,16 @@
 # -*- coding: utf-8 -*-
+from sqlalchemy import func, orm
+from sqlalchemy.exc import IntegrityError
 from sqlservice import SQLClient
 
-from .models import Model, ApplicationTagVersion, ApplicationTag
-from cgadmin.schema import schema_project
+from .models import (Model, ApplicationTagVersion, ApplicationTag, DuplicateFamilyNameError,
+                     Customer, Family, FamilyPanel, Job, Project, Sample, User)
+from cgadmin.schema import build_schema, load_catalog
 
 
-class AdminDatabase(SQLClient):
-    """docstring for AdminDatabase"""
-    def __init__(self, db_uri):
-        super(AdminDatabase, self).__init__({'SQL_DATABASE_URI': db_uri}, model_class=Model)
+class AdminApi(object):
+
+    """Queries shared by the command line client and the Flask extension."""
 
     def latest_version(self, apptag_id):
         """Get the latest version of an application tag."""
@@ -20,16 +22,137 @@ class AdminDatabase(SQLClient):
         return version
 
     def full_schema(self):
-        """Fill out schema with all possible values."""
-        schema_project['properties']['customer'] = {
-            "enum": [customer.customer_id for customer in self.Customer]
-        }
-        schema_project['properties']['families']['items']['properties']['samples']['items']['properties']['application_tag'] = {
-            "enum": [apptag.name for apptag in self.ApplicationTag]
-        }
-        return schema_project
+        """Fill out a copy of the schema with all possible values."""
+        return build_schema(*load_catalog(self))
 
     def invoice(self, invoice_id):
         """Fetch invoice record from the database."""
         invoice_obj = self.Invoice.filter_by(invoice_id=invoice_id).first()
         return invoice_obj
+
+    def project_graph(self, project_id):
+        """Fetch a project with everything needed to display or submit it.
+
+        Families, panels, samples, parents, application tags and their
+        versions are loaded up front in a fixed number of queries instead of
+        lazily one by one.
+        """
+        families_path = orm.selectinload(Project.families)
+        samples_path = families_path.selectinload(Family.samples)
+        project_obj = (self.Project
+                           .options(orm.joinedload(Project.customer),
+                                    families_path.selectinload(Family.panel_links),
+                                    samples_path.joinedload(Sample.mother),
+                                    samples_path.joinedload(Sample.father),
+                                    samples_path.joinedload(Sample.application_tag)
+                                                .selectinload(ApplicationTag.versions))
+                           .filter(Project.id == project_id)
+                           .first())
+        return project_obj
+
+    def project_overview(self, customer_ids=None, limit=50):
+        """List the latest projects with their sizes and submission state.
+
+        Everything is computed in a single query so listing projects doesn't
+        load any families or samples. Each row has `id`, `name`,
+        `user_name`, `is_locked`, `lims_id`, `family_count`, `sample_count`,
+        `job_status` and `job_message` (from the latest submission job, if
+        any).
+        """
+        family_count = (self.query(func.count(Family.id))
+                            .filter(Family.project_id == Project.id)
+                            .correlate(Project)
+                            .as_scalar())
+        sample_count = (self.query(func.count(Sample.id))
+                            .join(Sample.family)
+                            .filter(Family.project_id == Project.id)
+                            .correlate(Project)
+                            .as_scalar())
+        latest_job = (self.query(func.max(Job.id))
+                          .filter(Job.project_id == Project.id)
+                          .correlate(Project)
+                          .as_scalar())
+        job_status = (self.query(Job.status)
+                          .filter(Job.id == latest_job)
+                          .as_scalar())
+        job_message = (self.query(Job.message)
+                           .filter(Job.id == latest_job)
+                           .as_scalar())
+        project_q = (self.query(Project.id, Project.name, Project.is_locked, Project.lims_id,
+                                User.name.label('user_name'),
+                                family_count.label('family_count'),
+                                sample_count.label('sample_count'),
+                                job_status.label('job_status'),
+                                job_message.label('job_message'))
+                         .join(Project.user))
+        if customer_ids is not None:
+            project_q = project_q.filter(Project.customer_id.in_(customer_ids))
+        return project_q.order_by(Project.created_at.desc()).limit(limit).all()
+
+    def customer_choices(self):
+        """List id, name and customer id of all customers, for select boxes."""
+        customer_q = (self.query(Customer.id, Customer.name, Customer.customer_id)
+                          .order_by(Customer.customer_id))
+        return customer_q.all()
+
+    def families_with_panel(self, panel, since=None):
+        """Query families ordered with a gene panel, optionally only from
+        projects created after a date."""
+        family_q = (self.Family.join(Family.panel_links)
+                               .filter(FamilyPanel.panel == panel))
+        if since:
+            family_q = family_q.join(Family.project).filter(Project.created_at >= since)
+        return family_q
+
+    def duplicate_families(self, customer_id, names, exclude_ids=None):
+        """Find which of the names are already used by new families of a customer.
+
+        All names are checked with a single query on the unique
+        (customer_id, unique_name) index. Names repeated in `names` also count
+        as duplicates. Re-orders of existing families don't take up a name.
+        """
+        names = list(names)
+        duplicates = set(name for name in names if names.count(name) > 1)
+        if names:
+            family_q = (self.query(Family.unique_name)
+                            .filter(Family.customer_id == customer_id,
+                                    Family.unique_name.in_(set(names))))
+            if exclude_ids:
+                family_q = family_q.filter(~Family.id.in_(exclude_ids))
+            # don't flush pending families before we have checked them
+            with self.session.no_autoflush:
+                duplicates.update(row[0] for row in family_q)
+        return duplicates
+
+    def check_family_names(self, customer_id, names, exclude_ids=None):
+        """Raise if any of the family names are already used by the customer."""
+        duplicates = self.duplicate_families(customer_id, names, exclude_ids=exclude_ids)
+        if duplicates:
+            raise DuplicateFamilyNameError(', '.join(sorted(duplicates)))
+
+    def save_family(self, family_obj):
+        """Save a family, reporting a taken name as `DuplicateFamilyNameError`."""
+        if family_obj.existing_family:
+            return self.Family.save(family_obj)
+        customer_id = family_obj.project.customer_id
+        try:
+            self.check_family_names(customer_id, [family_obj.name],
+                                    exclude_ids=[family_obj.id] if family_obj.id else None)
+        except DuplicateFamilyNameError:
+            # drop the pending changes like a failed save would
+            self.rollback()
+            raise
+        try:
+            return self.Family.save(family_obj)
+        except IntegrityError:
+            self.rollback()
+            if self.duplicate_families(customer_id, [family_obj.name]):
+                # lost a race against another save of the same name
+                raise DuplicateFamilyNameError(family_obj.name)
+            raise
+
+
+class AdminDatabase(AdminApi, SQLClient):
+    """docstring for AdminDatabase"""
+    def __init__(self, db_uri):
+        super(AdminDatabase, self).__init__({'SQL_DATABASE_URI': db_uri}, model_class=Model)
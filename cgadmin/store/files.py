@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+from contextlib import contextmanager
+import hashlib
+import io
+import os
+import tempfile
+
+
+class FileStore(object):
+
+    """Files on local disk addressed by the SHA-256 of their content.
+
+    A file is stored once no matter how many rows refer to it, under
+    `<root>/<first two hex digits>/<checksum>`.
+    """
+
+    def __init__(self, root):
+        super(FileStore, self).__init__()
+        self.root = root
+
+    def put(self, file_obj, chunk_size=64 * 1024):
+        """Copy a file object into the store and return its checksum."""
+        sha = hashlib.sha256()
+        with atomic_write(lambda: self.path(sha.hexdigest()), temp_dir=self.root) as temp_file:
+            for chunk in iter(lambda: file_obj.read(chunk_size), b''):
+                sha.update(chunk)
+                temp_file.write(chunk)
+        return sha.hexdigest()
+
+    def put_bytes(self, content):
+        """Store a bytes object and return its checksum."""
+        return self.put(io.BytesIO(content))
+
+    def path(self, checksum):
+        """Get the path to a stored file."""
+        return os.path.join(self.root, checksum[:2], checksum)
+
+    def exists(self, checksum):
+        """Check if a file is in the store."""
+        return os.path.exists(self.path(checksum))
+
+    def open(self, checksum):
+        """Open a stored file for reading."""
+        return open(self.path(checksum), 'rb')
+
+
+@contextmanager
+def atomic_write(path, mode='wb', temp_dir=None):
+    """Write a file through a temporary file that is renamed when done.
+
+    Readers never see a partial file and nothing is left behind on errors.
+
+    Args:
+        path (str|callable): final path, or a function returning it once the
+            content is written
+        temp_dir (Optional[str]): where to write, defaults to the directory
+            of `path`; must be on the same file system
+    """
+    temp_dir = temp_dir or os.path.dirname(path)
+    if not os.path.isdir(temp_dir):
+        os.makedirs(temp_dir)
+    handle, temp_path = tempfile.mkstemp(dir=temp_dir, suffix='.tmp')
+    try:
+        with os.fdopen(handle, mode) as temp_file:
+            yield temp_file
+        final_path = path() if callable(path) else path
+        if not os.path.isdir(os.path.dirname(final_path)):
+            os.makedirs(os.path.dirname(final_path))
+        os.replace(temp_path, final_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
@@ -1,12 +1,15 @@
 # -*- coding: utf-8 -*-
+import copy
 from datetime import datetime
+import json
 
-import ruamel.yaml
 from sqlalchemy import Column, types, orm, ForeignKey, UniqueConstraint, Table
 from sqlservice import declarative_base, event
 
 from cgadmin import constants
+from cgadmin.schema import VALIDATORS
 from cgadmin.server.admin import UserManagementMixin
+from . import serialize
 
 Model = declarative_base()
 
@@ -51,6 +54,11 @@ class Customer(Model):
     users = orm.relationship('User', secondary=customer_user_link, back_populates='customers')
     projects = orm.relationship('Project', cascade='all,delete', backref='customer')
 
+    @event.after_save()
+    @event.after_delete()
+    def catalog_changed(mapper, connection, target):
+        VALIDATORS.bump()
+
     def __unicode__(self):
         return self.customer_id
 
@@ -90,6 +98,15 @@ class Project(Model):
 
     families = orm.relationship('Family', backref='project')
 
+    @event.after_update()
+    def after_update(mapper, connection, target):
+        # keep the customer of the families in sync
+        if orm.attributes.get_history(target, 'customer_id').has_changes():
+            family_table = Family.__table__
+            connection.execute(family_table.update()
+                                           .where(family_table.c.project_id == target.id)
+                                           .values(customer_id=target.customer_id))
+
     @property
     def samples(self):
         """Return all the samples."""
@@ -107,10 +124,14 @@ class Project(Model):
 class Family(Model):
 
     __tablename__ = 'family'
+    __table_args__ = (UniqueConstraint('customer_id', 'unique_name',
+                                       name='_customer_family_name_uc'),)
 
     id = Column(types.Integer, primary_key=True)
     name = Column(types.String(64), nullable=False)
-    _panels = Column(types.Text)
+    # name of families ordered for the first time, re-orders of an existing
+    # family (NULL here) may reuse the name
+    unique_name = Column(types.String(64))
     priority = Column(types.Enum(*constants.PRIORITIES), nullable=False)
     delivery_type = Column(types.Enum(*constants.DELIVERY_TYPES), nullable=False)
     require_qcok = Column(types.Boolean, default=False)
@@ -118,20 +139,18 @@ class Family(Model):
     keep_vis = Column(types.Boolean, default=False)
 
     project_id = Column(ForeignKey(Project.id, ondelete='CASCADE'), nullable=False)
+    # copied from the project to enforce unique names per customer
+    customer_id = Column(ForeignKey(Customer.id), nullable=False)
     samples = orm.relationship('Sample', backref='family', order_by='Sample.id')
+    panel_links = orm.relationship('FamilyPanel', backref='family', order_by='FamilyPanel.id',
+                                   cascade='all,delete-orphan')
 
     @event.before_save()
     def before_save(mapper, connection, target):
-        query = """
-            SELECT * FROM family
-            INNER JOIN project ON family.project_id = project.id
-            WHERE family.name = "{}"
-            AND project.customer_id = "{}"
-        """.format(target.name, target.project.customer_id)
-        if target.id:
-            query += """AND family.id != {}""".format(target.id)
-        if connection.scalar(query) == 1:
-            raise DuplicateFamilyNameError(target.name)
+        # family names are unique per customer, see `_customer_family_name_uc`
+        if target.project is not None:
+            target.customer_id = target.project.customer_id
+        target.unique_name = None if target.existing_family else target.name
 
     def __unicode__(self):
         return self.name
@@ -142,12 +161,19 @@ class Family(Model):
     @property
     def panels(self):
         """Return a list of panels."""
-        panel_list = self._panels.split(',') if self._panels else []
+        panel_list = [link.panel for link in self.panel_links]
         return panel_list
 
     @panels.setter
     def panels(self, panel_list):
-        self._panels = ','.join(panel_list) if panel_list else None
+        # keep links to panels that remain, re-adding them would break the
+        # unique constraint since inserts are flushed before deletes
+        existing = {link.panel: link for link in self.panel_links}
+        new_links = []
+        for panel in panel_list or []:
+            if panel not in (link.panel for link in new_links):
+                new_links.append(existing.get(panel) or FamilyPanel(panel=panel))
+        self.panel_links = new_links
 
     @property
     def suggested_tag(self):
@@ -157,6 +183,18 @@ class Family(Model):
                 return sample.application_tag
 
 
+class FamilyPanel(Model):
+
+    """Gene panel ordered for a family."""
+
+    __tablename__ = 'family_panel'
+    __table_args__ = (UniqueConstraint('family_id', 'panel', name='_family_panel_uc'),)
+
+    id = Column(types.Integer, primary_key=True)
+    family_id = Column(ForeignKey(Family.id, ondelete='CASCADE'), nullable=False)
+    panel = Column(types.String(64), nullable=False, index=True)
+
+
 class Sample(Model):
 
     __tablename__ = 'sample'
@@ -215,6 +253,11 @@ class ApplicationTag(Model):
                                 backref='apptag')
     samples = orm.relationship('Sample', backref='application_tag')
 
+    @event.after_save()
+    @event.after_delete()
+    def catalog_changed(mapper, connection, target):
+        VALIDATORS.bump()
+
     @property
     def latest(self):
         return self.versions[0] if self.versions else None
@@ -294,16 +337,110 @@ class Invoice(Model):
     sent_at = Column(types.DateTime)
     costcenter = Column(types.Enum('kth', 'ki'))
     comment = Column(types.Text)
-    excel_file_kth = Column(types.BLOB)
-    excel_file_ki = Column(types.BLOB)
-    _data = Column(types.Text)
+    # SHA-256 of modified Excel invoices kept in the file store
+    excel_kth_checksum = Column(types.String(64))
+    excel_ki_checksum = Column(types.String(64))
+    _packed_data = Column('packed_data', types.LargeBinary(length=2 ** 24 - 1))
+
+    @property
+    def data(self):
+        """Store data for an invoice as compressed JSON.
+
+        The parsed data is kept on the instance until the column changes,
+        callers get their own copy to modify.
+        """
+        cached = getattr(self, '_data_cache', None)
+        if cached is None or cached[0] is not self._packed_data:
+            parsed = serialize.unpack(self._packed_data) if self._packed_data else {}
+            cached = self._data_cache = (self._packed_data, parsed)
+        return copy.deepcopy(cached[1])
+
+    @data.setter
+    def data(self, invoice_data):
+        self._packed_data = serialize.pack(invoice_data) if invoice_data else None
+        self._data_cache = None
+
+
+class Job(Model):
+
+    """Queued submission of a project to LIMS."""
+
+    __tablename__ = 'job'
+
+    id = Column(types.Integer, primary_key=True)
+    status = Column(types.Enum(*constants.JOB_STATUSES), default='pending', nullable=False)
+    stage = Column(types.String(32))
+    created_at = Column(types.DateTime, default=datetime.now)
+    started_at = Column(types.DateTime)
+    finished_at = Column(types.DateTime)
+    # updated regularly by the worker while the job is running
+    heartbeat_at = Column(types.DateTime)
+    user_id = Column(ForeignKey(User.id))
+    project_id = Column(ForeignKey(Project.id, ondelete='CASCADE'))
+    open_ticket = Column(types.Boolean, default=True)
+    lims_id = Column(types.String(32))
+    ticket_id = Column(types.String(32))
+    message = Column(types.Text)
+    _data = Column(types.Text, nullable=False)
+    _progress = Column(types.Text)
+
+    user = orm.relationship(User)
+    project = orm.relationship(Project, backref='jobs')
 
     @property
     def data(self):
-        """Store data for an invoice as a YAML string."""
-        yaml_data = ruamel.yaml.safe_load(self._data) if self._data else {}
-        return yaml_data
+        """Project data to submit, stored as a JSON string."""
+        return json.loads(self._data)
 
     @data.setter
-    def data(self, yaml_data):
-        self._data = ruamel.yaml.dump(yaml_data) if yaml_data else None
+    def data(self, project_data):
+        self._data = json.dumps(project_data)
+
+    @property
+    def progress(self):
+        """Progress per stage as {stage: {'done': int, 'total': int}}."""
+        return json.loads(self._progress) if self._progress else {}
+
+    @progress.setter
+    def progress(self, progress_data):
+        self._progress = json.dumps(progress_data)
+
+    @property
+    def is_active(self):
+        return self.status in ('pending', 'running')
+
+    @property
+    def name(self):
+        """Name of the submitted project."""
+        return self.data.get('name')
+
+    def __unicode__(self):
+        return "job {}".format(self.id)
+
+    def __str__(self):
+        return "job {}".format(self.id)
+
+
+class JournalEntry(Model):
+
+    """LIMS entity created while submitting a project."""
+
+    __tablename__ = 'journal_entry'
+    __table_args__ = (UniqueConstraint('project_id', 'kind', 'name',
+                                       name='_project_kind_name_uc'),)
+
+    id = Column(types.Integer, primary_key=True)
+    project_id = Column(ForeignKey(Project.id, ondelete='CASCADE'), nullable=False)
+    kind = Column(types.Enum(*constants.JOURNAL_KINDS), nullable=False)
+    name = Column(types.String(128), nullable=False)
+    lims_uri = Column(types.String(255), nullable=False)
+    created_at = Column(types.DateTime, default=datetime.now)
+
+    project = orm.relationship(Project, backref=orm.backref('journal',
+                                                            cascade='all, delete-orphan'))
+
+    def __unicode__(self):
+        return "{} {}".format(self.kind, self.name)
+
+    def __str__(self):
+        return "{} {}".format(self.kind, self.name)
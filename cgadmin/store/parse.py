@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+from . import models
 
 
 def parse_db_project(new_project):
@@ -48,3 +49,58 @@ def parse_db_project(new_project):
         project_data['families'].append(family_data)
 
     return project_data
+
+
+def build_db_project(admin_db, project_data, user, name=None):
+    """Build a draft Project with families and samples from project JSON."""
+    customer = admin_db.Customer.filter_by(customer_id=project_data['customer']).first()
+    if customer is None:
+        raise ValueError("unknown customer: {}".format(project_data['customer']))
+    apptag_names = set(sample_data['application_tag'] for family_data in
+                       project_data['families'] for sample_data in family_data['samples']
+                       if sample_data.get('application_tag'))
+    apptags = {apptag_obj.name: apptag_obj for apptag_obj in
+               admin_db.ApplicationTag.filter(models.ApplicationTag.name.in_(apptag_names))}
+
+    new_project = models.Project(name=name or project_data['name'], customer=customer,
+                                 user=user)
+    for family_data in project_data['families']:
+        new_family = models.Family(
+            name=family_data['name'],
+            priority=family_data['priority'],
+            delivery_type=family_data['delivery_type'],
+            require_qcok=family_data.get('require_qcok', False),
+            existing_family=family_data.get('existing_family', False),
+            keep_vis=family_data.get('keep_vis', False),
+        )
+        new_family.panels = family_data.get('panels')
+        new_project.families.append(new_family)
+
+        sample_map = {}
+        for sample_data in family_data['samples']:
+            new_sample = models.Sample(name=sample_data['name'])
+            for key in ('sex', 'status', 'source', 'container', 'container_name',
+                        'well_position', 'quantity', 'capture_kit', 'comment',
+                        'existing_sample', 'exclude_analysis'):
+                if sample_data.get(key) is not None:
+                    setattr(new_sample, key, sample_data[key])
+            if sample_data.get('application_tag'):
+                apptag_name = sample_data['application_tag']
+                apptag_obj = apptags.get(apptag_name)
+                if apptag_obj is None:
+                    raise ValueError("unknown application tag: {}".format(apptag_name))
+                new_sample.application_tag = apptag_obj
+            new_family.samples.append(new_sample)
+            sample_map[new_sample.name] = new_sample
+
+        for sample_data in family_data['samples']:
+            for parent_id in ('father', 'mother'):
+                parent_name = sample_data.get(parent_id)
+                if parent_name:
+                    if parent_name not in sample_map:
+                        raise ValueError("sample relation error: {}, {} -> {}"
+                                         .format(sample_data['name'], parent_id, parent_name))
+                    setattr(sample_map[sample_data['name']], parent_id,
+                            sample_map[parent_name])
+
+    return new_project
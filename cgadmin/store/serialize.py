@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+import datetime
+import json
+import zlib
+
+DATE_KEY = '$date'
+DATETIME_KEY = '$datetime'
+
+
+def pack(data):
+    """Serialize data as zlib compressed JSON, keeping dates intact."""
+    json_str = json.dumps(data, default=encode_value, separators=(',', ':'), sort_keys=True)
+    return zlib.compress(json_str.encode('utf-8'))
+
+
+def unpack(packed_data):
+    """Load data serialized with `pack`."""
+    json_str = zlib.decompress(packed_data).decode('utf-8')
+    return json.loads(json_str, object_hook=decode_value)
+
+
+def encode_value(value):
+    """Represent dates as tagged ISO strings."""
+    if isinstance(value, datetime.datetime):
+        return {DATETIME_KEY: value.isoformat()}
+    elif isinstance(value, datetime.date):
+        return {DATE_KEY: value.isoformat()}
+    raise TypeError("can't serialize: {!r}".format(value))
+
+
+def decode_value(obj):
+    """Turn tagged ISO strings back into dates."""
+    if len(obj) == 1:
+        if DATE_KEY in obj:
+            return datetime.datetime.strptime(obj[DATE_KEY], '%Y-%m-%d').date()
+        elif DATETIME_KEY in obj:
+            value = obj[DATETIME_KEY]
+            date_format = '%Y-%m-%dT%H:%M:%S.%f' if '.' in value else '%Y-%m-%dT%H:%M:%S'
+            return datetime.datetime.strptime(value, date_format)
+    return obj